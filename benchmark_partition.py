@@ -0,0 +1,40 @@
+from generation.sbm import SBM
+from model.graph_mcmc import Graph_MCMC
+from sklearn.metrics import adjusted_rand_score
+import numpy as np
+import time
+
+
+def benchmark(n, B, c_in, c_out, inits=(None, "spectral", "abp"), seed=0):
+    """
+    Compares cold-start minimize_blockmodel_dl against warm starts on an SBM graph
+    c_in: expected neighbours of a vertex within its own block
+    c_out: expected neighbours of a vertex in each other block
+    """
+    np.random.seed(seed)
+    prior = np.ones(B) / B
+    W = (c_in - c_out) * np.identity(B) + c_out * np.ones((B, B))
+    # maxent SBM propensities (unit fugacities): pair in blocks r, s links w.p. ~ W[r, s] for small W,
+    # so c / n_r gives a sparse graph with expected degree c_in + (B - 1) c_out
+    W = W * B / n
+    sbm = SBM(n, B, prior, W)
+
+    print("n={} B={} c_in={} c_out={} M={}".format(n, B, c_in, c_out, sbm.graph.num_edges()))
+    for init in inits:
+        # abp seeds two communities, merge-split refinement has to find any others
+        graph = Graph_MCMC(use_cache=False)
+        graph.G = sbm.graph
+
+        start = time.time()
+        b = graph.partition(B_min=1, B_max=2 * B, seed=seed, init=init)
+        elapsed = time.time() - start
+
+        ari = adjusted_rand_score(sbm.true_block_labels, np.asarray(b.a))
+        print("{:>8}: time={:.2f}s B={} DL={:.1f} ARI={:.3f}".format(
+            str(init), elapsed, graph.state.get_nonempty_B(), graph.description_length(), ari))
+
+
+if __name__ == "__main__":
+    benchmark(1000, 2, 10, 2)
+    benchmark(5000, 4, 12, 2)
+    benchmark(20000, 8, 12, 2)
@@ -1,103 +1,98 @@
-import csv
 import os
-from data.names import NameList
+import io
+import numpy as np
+from multiprocessing import Pool
+from data.names import NameList, GENDER_CODES
+from utils.counting import lookup_codes, pair_counts
 from hypothesis.test_statistics import two_samples_mean_ll_ratio, students_z_test
 
 
 curr_dir = os.path.dirname(__file__)
 aminer_dir = os.path.join(curr_dir, "aminer")
 
+GENDER_CACHE = "AMiner-Author-Gender.npy"
+
 
 class AMiner:
 
-    def __init__(self, raw = True):
+    def __init__(self, raw = True, processes=None):
         if raw:
-            self.gender_by_author_id = self._read_author_genders_raw()
+            self.gender_codes = self._read_author_genders_raw(processes)
         else:
-            self.gender_by_author_id = self._read_genders_quick()
+            self.gender_codes = self._read_genders_quick()
 
-        M = F = 0
-        for gender in self.gender_by_author_id.values():
-            if gender == "M":
-                M += 1
-            elif gender == "F":
-                F += 1
+        counts = np.bincount(self.gender_codes, minlength=len(GENDER_CODES))
+        self.M = int(counts[GENDER_CODES.index("M")])
+        self.F = int(counts[GENDER_CODES.index("F")])
 
-        self.M = M
-        self.F = F
 
+    def get_gender(self, author_id):
+        """Gender of author ("U" if unknown)"""
+        if 0 <= author_id < len(self.gender_codes):
+            return GENDER_CODES[self.gender_codes[author_id]]
+        return "U"
 
-    def _read_author_genders_raw(self):
-        name_list = NameList()
+
+    def _read_author_genders_raw(self, processes=None):
+        """
+        Parses author file in chunks (split at #index records) across a process pool
+        Writes dense gender code array indexed by author id to AMiner-Author-Gender.npy
+        """
         filename = "AMiner-Author.txt"
         filepath = os.path.join(aminer_dir, filename)
 
-        outfilename = "AMiner-Author-Gender.txt"
-        outfilepath = os.path.join(aminer_dir, outfilename)
-        outfile = open(outfilepath, "w")
-
-        author_id = 0
-        gender_by_author_id = {}
-
-        with open(filepath) as fp:
-            for line in fp:
-                if line.startswith("#index"):
-                    author_id = int(line[7:])
-                elif line.startswith("#n"):
-                    full_name = line[3:]
-                    first_name = full_name.split(" ")[0]
-                    
-                    gender = "U"
-                    if "." not in first_name:
-                        gender = name_list.get_gender_of(first_name)
+        num_chunks = 4 * (processes or os.cpu_count() or 1)
+        chunks = [(filepath, start, end) for start, end in _find_record_chunks(filepath, num_chunks)]
+        # build (or load) name table once, workers receive it rather than touching its cache
+        name_list = NameList()
+        with Pool(processes, initializer=_init_author_worker, initargs=(name_list,)) as pool:
+            parsed = pool.map(_parse_author_chunk, chunks)
 
+        author_ids = np.concatenate([ids for ids, _codes in parsed])
+        codes = np.concatenate([codes for _ids, codes in parsed])
 
-                    gender_by_author_id[author_id] = gender
-                    outfile.write(str(author_id) + "," + gender + "\n")
+        gender_codes = np.zeros(author_ids.max() + 1 if len(author_ids) > 0 else 0, dtype=np.uint8)
+        gender_codes[author_ids] = codes
 
-        outfile.close()
-        return gender_by_author_id
+        np.save(os.path.join(aminer_dir, GENDER_CACHE), gender_codes)
+        return gender_codes
 
 
     def _read_genders_quick(self):
-        filename = "AMiner-Author-Gender.txt"
-        filepath = os.path.join(aminer_dir, filename)
-
-        gender_by_author_id = {}
-        with open(filepath) as fp:
-            reader = csv.reader(fp, delimiter=",")
-            for row in reader:
-                author_id = int(row[0])
-                gender = row[1]
-                gender_by_author_id[author_id] = gender
-
-        return gender_by_author_id
-
-    def check_gender_disparity(self):
+        return np.load(os.path.join(aminer_dir, GENDER_CACHE), mmap_mode="r")
+
+    def count_coauthor_pairs(self, codes, num_categories, weighted=False, block_size=2**26):
+        """
+        (C x C) counts of co-author pairs by categorical author attribute (upper triangle)
+
+            Parameters:
+                codes (int[]): dense code array indexed by author id (missing authors get code 0)
+                num_categories (int): C
+                weighted (bool): weight pairs by their co-authorship count (third column)
+                block_size (int): bytes parsed per block
+        """
         filename = "AMiner-Coauthor.txt"
         filepath = os.path.join(aminer_dir, filename)
 
-        m2m = 0
-        m2f = 0
-        f2f = 0
+        counts = np.zeros((num_categories, num_categories), dtype=float if weighted else np.int64)
+        for rows in _read_coauthor_blocks(filepath, block_size):
+            codes_a = lookup_codes(codes, rows[:, 0])
+            codes_b = lookup_codes(codes, rows[:, 1])
+            weights = rows[:, 2] if weighted else None
+            counts += pair_counts(codes_a, codes_b, num_categories, weights)
+        return counts
 
-        print("Population sizes:\nM = {} , F = {}".format(self.M, self.F))
 
-        with open(filepath) as fp:
-            for line in fp:
-                [author_a, author_b, _count] = line.split() #splits by any number of whitespace
-                author_a = int(author_a[1:]) # remove leading #
-                author_b = int(author_b)
+    def check_gender_disparity(self, weighted=False):
+        print("Population sizes:\nM = {} , F = {}".format(self.M, self.F))
 
-                gender_a = self.gender_by_author_id.get(author_a)
-                gender_b = self.gender_by_author_id.get(author_b)
+        counts = self.count_coauthor_pairs(self.gender_codes, len(GENDER_CODES), weighted)
 
-                if gender_a == "M" and gender_b == "M":
-                    m2m += 1
-                elif gender_a == "M" or gender_b == "M":
-                    m2f += 1
-                else:
-                    f2f += 1
+        # unknown genders and missing authors are counted with F
+        is_m = np.array([code == "M" for code in GENDER_CODES])
+        m2m = counts[is_m][:, is_m].sum()
+        m2f = counts[is_m][:, ~is_m].sum() + counts[~is_m][:, is_m].sum()
+        f2f = counts[~is_m][:, ~is_m].sum()
 
         m2m_max = int(self.M * (self.M + 1) / 2)
         m2f_max = self.M * self.F
@@ -110,4 +105,76 @@ class AMiner:
         _t, p3 = two_samples_mean_ll_ratio(m2f_max, f2f_max, m2f, f2f)
 
         print("p-values for (1: m2m v m2f ; 2: m2m v f2f ; 3: m2f v f2f):")
-        print("p1 = {:.3e} , p2 = {:.3e} , p3 = {:.3e}".format(float(p1), float(p2), float(p3)))
\ No newline at end of file
+        print("p1 = {:.3e} , p2 = {:.3e} , p3 = {:.3e}".format(float(p1), float(p2), float(p3)))
+
+
+def _find_record_chunks(filepath, num_chunks):
+    """(start, end) byte ranges of about equal size, each starting at an #index line"""
+    size = os.path.getsize(filepath)
+    offsets = [0]
+    with open(filepath, "rb") as fp:
+        for chunk in range(1, num_chunks):
+            fp.seek(max(chunk * size // num_chunks, offsets[-1]))
+            fp.readline() # skip partial line
+            while True:
+                offset = fp.tell()
+                line = fp.readline()
+                if not line or line.startswith(b"#index"):
+                    break
+            if offset > offsets[-1]:
+                offsets.append(offset)
+
+    if offsets[-1] < size:
+        offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+# author parsing workers
+_name_list = None
+
+
+def _init_author_worker(name_list):
+    global _name_list
+    _name_list = name_list
+
+
+def _parse_author_chunk(chunk):
+    """Returns author ids and gender codes of the records in a byte range"""
+    filepath, start, end = chunk
+    with open(filepath, "rb") as fp:
+        fp.seek(start)
+        text = fp.read(end - start).decode("utf-8", errors="replace")
+
+    author_id = 0
+    author_ids = []
+    first_names = []
+
+    for line in io.StringIO(text):
+        if line.startswith("#index"):
+            author_id = int(line[7:])
+        elif line.startswith("#n"):
+            full_name = line[3:]
+            author_ids.append(author_id)
+            first_names.append(full_name.split(" ")[0])
+
+    codes = _name_list.get_genders(first_names)
+    codes[np.char.find(np.asarray(first_names, dtype=str), ".") >= 0] = GENDER_CODES.index("U")
+    return np.array(author_ids, dtype=np.int64), codes
+
+
+def _read_coauthor_blocks(filepath, block_size):
+    """Yields (n x 3) int arrays of (author_a, author_b, count) parsed from blocks of whole lines"""
+    remainder = b""
+    with open(filepath, "rb") as fp:
+        while True:
+            block = fp.read(block_size)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind(b"\n") + 1
+            block, remainder = block[:cut], block[cut:]
+            if block:
+                yield np.array(block.replace(b"#", b"").split(), dtype=np.int64).reshape(-1, 3)
+
+    if remainder.strip():
+        yield np.array(remainder.replace(b"#", b"").split(), dtype=np.int64).reshape(-1, 3)
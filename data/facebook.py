@@ -7,8 +7,12 @@ from tqdm import tqdm
 import matplotlib.pyplot as plt
 from utils.colors import color_between
 import pandas as pd
-from sklearn import linear_model
+from scipy.sparse.linalg import lsqr
 from utils.plotting import sorted_bar_plot
+from model.feature_store import FeatureStore
+from utils.storage import atomic_savez, load_npz
+from multiprocessing import Pool
+import scipy.sparse as sp
 
 
 curr_dir = os.path.dirname(__file__)
@@ -23,20 +27,26 @@ class FacebookGraph:
 
     def __init__(self, ego_id, significance_level=99):
         self.ego_id = str(ego_id)
-        self.edges = self.read_edges()
         self.feature_names = self.read_feature_names()
-        self.node_features = self.read_node_features()
         self.significance_level = significance_level
+        self.keyword_index = None # feature ids by name segment
 
-        # add edges from ego node
-        for node_id in self.node_features.keys():
-            self.edges.append((self.ego_id, node_id))
+        # packed (N x D) feature flags, row i belongs to node_ids[i] (ego node last)
+        node_ids, flags = self.read_node_features()
+        ego_flags = self.read_ego_features()
+        self.node_ids = np.append(node_ids, np.int64(self.ego_id))
+        self.node_index = {node_id: row for row, node_id in enumerate(self.node_ids.tolist())}
+        names = [self.feature_names[feature_id] for feature_id in range(0, flags.shape[1])]
+        self.features = FeatureStore.from_dense(names, np.vstack((flags, ego_flags)))
 
-        # add ego features
-        self.node_features[self.ego_id] = self.read_ego_features()
+        # add edges from ego node
+        ego_edges = np.column_stack((np.full(len(node_ids), np.int64(self.ego_id)), node_ids))
+        self.edge_array = np.vstack((self.read_edges(), ego_edges)) # (M x 2) node ids
+        self.edge_rows = self.node_rows(self.edge_array) # (M x 2) feature rows
+        self.edges = [tuple(edge) for edge in self.edge_array.tolist()]
 
         # constants
-        self.N = len(self.node_features)
+        self.N = len(self.node_ids)
         self.M = len(self.edges)
         self.D = len(self.feature_names)
 
@@ -49,11 +59,14 @@ class FacebookGraph:
         return rows
 
 
+    def read_int_file(self, extension):
+        """Whitespace separated integer table as (rows x columns) array"""
+        filepath = os.path.join(facebook_dir, self.ego_id + extension)
+        return np.loadtxt(filepath, dtype=np.int64, ndmin=2)
+
+
     def read_edges(self):
-        extension = ".edges"
-        delimiter = " "
-        edge_transform = lambda edge: (edge[0], edge[1])
-        return self.read_graph_file(extension, delimiter, edge_transform)
+        return self.read_int_file(".edges").reshape(-1, 2)
 
 
     def read_feature_names(self):
@@ -65,77 +78,106 @@ class FacebookGraph:
 
 
     def read_ego_features(self):
-        extension = ".egofeat"
-        delimiter = " "
-
-        boolean_arr_to_set = lambda boolean_arr: {idx for idx, feature_set in enumerate(boolean_arr) if feature_set == "1"}
-        feature_set = self.read_graph_file(extension, delimiter, boolean_arr_to_set)
-        return feature_set[0]
+        return self.read_int_file(".egofeat")[0:1] != 0
 
     
     def read_node_features(self):
-        extension = ".feat"
-        delimiter = " "
-        node_transform = lambda node_row: (node_row[0], node_row[1:])
-        boolean_arr_to_set = lambda boolean_arr: {idx for idx, feature_set in enumerate(boolean_arr) if feature_set == "1"}
-
-        features_by_node_arr = self.read_graph_file(extension, delimiter, node_transform)
-        return {node_feature[0]: boolean_arr_to_set(node_feature[1]) for node_feature in features_by_node_arr}
+        """Returns node ids (int64[]) and (N x D) boolean flags"""
+        table = self.read_int_file(".feat")
+        return table[:, 0], table[:, 1:] != 0
+
+
+    def node_rows(self, node_ids):
+        """Feature rows of (array of) node ids"""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        order = np.argsort(self.node_ids)
+        positions = np.searchsorted(self.node_ids, node_ids, sorter=order)
+        positions = np.minimum(positions, len(order) - 1)
+        rows = order[positions]
+        if np.any(self.node_ids[rows] != node_ids):
+            raise KeyError("Unknown node ids")
+        return rows
 
 
     def same_community(self, node_a, node_b, feature_id):
-        node_a_features = self.node_features.get(node_a)
-        node_b_features = self.node_features.get(node_b)
-        return (feature_id in node_a_features) == (feature_id in node_b_features)
+        return self.node_has_feature(node_a, feature_id) == self.node_has_feature(node_b, feature_id)
 
 
     def same_community_multiple(self, node_a, node_b, feature_ids):
-        node_a_features = self.node_features.get(node_a)
-        node_b_features = self.node_features.get(node_b)
-        for feature_id in feature_ids:
-            if (feature_id in node_a_features) and (feature_id in node_b_features):
-                return True
-        return False
+        rows = self.node_rows([int(node_a), int(node_b)])
+        flags = self.features.to_dense(rows, feature_ids, dtype=bool)
+        return bool(np.any(flags[0] & flags[1]))
 
     
     def node_has_feature(self, node_id, feature_id):
-        node_feature_list = self.node_features.get(node_id)
-        return feature_id in node_feature_list
+        row = self.node_index[int(node_id)]
+        return bool(self.features.column(feature_id, [row])[0])
 
 
     def feature_name(self, feature_id):
         return self.feature_names.get(feature_id)
 
 
-    def hypothesis_test_single(self, feature_id):
-        """Is there evidence to suggest this feature affects how people interact"""
-        print("Testing whether feature-{}: {}".format(feature_id, self.feature_names.get(feature_id)))
-        print("Impacts probability of two random individuals being FB friends\n")
+    def edge_feature_counts(self, feature_ids=None, chunk_size=100000):
+        """
+        Edge counts by feature membership of their endpoints
 
-        N = len(self.node_features) # num nodes in graph
-        N_1 = 0 # num nodes with given feature_id
-        for features in self.node_features.values():
-            if feature_id in features:
-                N_1 += 1
+            Parameters:
+                feature_ids (int[]): features to count (default all)
 
-        N_2 = N - N_1 # num nodes without given feature
-        print("Num nodes with/without feature:\nN_1 = {} , N_2 = {}\n".format(N_1, N_2))
+            Returns:
+                a2a (int[]): edges with both endpoints having feature
+                a2b (int[]): edges with exactly one endpoint having feature
+                b2b (int[]): edges with neither endpoint having feature
+        """
+        D = self.D if feature_ids is None else len(feature_ids)
+        a2a = np.zeros(D, dtype=np.int64)
+        a2b = np.zeros(D, dtype=np.int64)
 
-        E_max = int(N * (N + 1) / 2) # max edges possible
+        for start in range(0, self.M, chunk_size):
+            rows = self.edge_rows[start:start+chunk_size]
+            flags_a = self.features.to_dense(rows[:, 0], feature_ids, dtype=bool)
+            flags_b = self.features.to_dense(rows[:, 1], feature_ids, dtype=bool)
+            a2a += np.sum(flags_a & flags_b, axis=0)
+            a2b += np.sum(flags_a ^ flags_b, axis=0)
+
+        return a2a, a2b, self.M - a2a - a2b
+
+
+    def hypothesis_test_all(self, feature_ids=None):
+        """
+        Within / between community likelihood ratio test for every feature at once
+
+            Returns:
+                t (float[]): t-statistic of each feature
+                p (float[]): p-value of each feature
+        """
+        N = self.N
+        N_1 = self.features.column_counts() # num nodes with each feature
+        if feature_ids is not None:
+            N_1 = N_1[feature_ids]
+        N_2 = N - N_1
 
+        E_max = int(N * (N + 1) / 2) # max edges possible
         m = N_1 * N_2 # num edges possible between communities
         n = E_max - m # num edges possible within communities
 
-        k = 0 # num edges within same community
-        l = 0 # num edges between communities
+        a2a, a2b, b2b = self.edge_feature_counts(feature_ids)
+        return two_samples_mean_ll_ratio(n, m, a2a + b2b, a2b)
 
-        for edge in self.edges:
-            if self.same_community(edge[0], edge[1], feature_id):
-                k += 1
-            else:
-                l += 1
 
-        t, p = two_samples_mean_ll_ratio(n, m, k, l)
+    def hypothesis_test_single(self, feature_id):
+        """Is there evidence to suggest this feature affects how people interact"""
+        print("Testing whether feature-{}: {}".format(feature_id, self.feature_names.get(feature_id)))
+        print("Impacts probability of two random individuals being FB friends\n")
+
+        N = self.N # num nodes in graph
+        N_1 = int(np.sum(self.features.column(feature_id))) # num nodes with given feature_id
+        N_2 = N - N_1 # num nodes without given feature
+        print("Num nodes with/without feature:\nN_1 = {} , N_2 = {}\n".format(N_1, N_2))
+
+        t, p = self.hypothesis_test_all([feature_id])
+        t, p = t[0], p[0]
         print("t-statistic: t = {:.3f}".format(t))
         print("p-value: p = {:.5f}\n".format(p))
 
@@ -150,30 +192,12 @@ class FacebookGraph:
         print("Testing whether feature-{}: {}".format(feature_id, self.feature_names.get(feature_id)))
         print("Impacts probability of two random individuals being FB friends\n")
 
-        N = len(self.node_features) # num nodes in graph
-        N_a = 0 # num nodes with given feature_id
-        for features in self.node_features.values():
-            if feature_id in features:
-                N_a += 1
-
+        N = self.N # num nodes in graph
+        N_a = int(np.sum(self.features.column(feature_id))) # num nodes with given feature_id
         N_b = N - N_a # num nodes without given feature
         print("Num nodes with/without feature:\nN_a = {} , N_b = {}\n".format(N_a, N_b))
 
-        a2a = 0
-        a2b = 0
-        b2b = 0
-
-
-        for edge in self.edges:
-            origin_is_A = feature_id in self.node_features.get(edge[0])
-            dest_is_A = feature_id in self.node_features.get(edge[1])
-
-            if origin_is_A and dest_is_A:
-                a2a += 1
-            elif origin_is_A or dest_is_A:
-                a2b += 1
-            else:
-                b2b += 1
+        a2a, a2b, b2b = [int(count[0]) for count in self.edge_feature_counts([feature_id])]
 
         a2a_max = int(N_a * (N_a + 1) / 2)
         a2b_max = N_a * N_b
@@ -195,40 +219,24 @@ class FacebookGraph:
         print("values: {}".format([self.feature_names.get(feature_id) for feature_id in feature_ids]))
         print("Impact probability of two random individuals being FB friends\n")
 
-        num_communities = len(feature_ids)
-        N_arr = [0] * num_communities # length
-        nodes = set()
-
-        for i in range(0, num_communities):
-            feature_id = feature_ids[i]
-            for node, features in self.node_features.items():
-                if feature_id in features:
-                    N_arr[i] += 1
-                    nodes.add(node)
+        flags = self.features.to_dense(columns=feature_ids, dtype=bool)
+        N_arr = np.sum(flags, axis=0) # length
+        in_nodes = np.any(flags, axis=1)
 
-        N = len(nodes)
-        if N != sum(N_arr):
+        N = int(np.sum(in_nodes))
+        if N != np.sum(N_arr):
             raise ValueError("Sets not disjoint")
 
-        print("Num nodes in each category:\n{}\n".format(N_arr))
+        print("Num nodes in each category:\n{}\n".format(N_arr.tolist()))
         E_max = int(N * (N + 1) / 2) # max edges possible
 
-        m = 0 # num edges possible between communities
-        for i in range(0, num_communities):
-            for j in range(i+1, num_communities):
-                m += N_arr[i] * N_arr[j]
-        
+        m = int((np.sum(N_arr) ** 2 - np.sum(N_arr ** 2)) / 2) # num edges possible between communities
         n = E_max - m # num edges possible within communities
 
-        k = 0 # num edges within same community
-        l = 0 # num edges between communities
-
-        for edge in self.edges:
-            if edge[0] in nodes and edge[1] in nodes:
-                if self.same_community_multiple(edge[0], edge[1], feature_ids):
-                    k += 1
-                else:
-                    l += 1
+        rows = self.edge_rows[in_nodes[self.edge_rows[:, 0]] & in_nodes[self.edge_rows[:, 1]]]
+        same = np.any(flags[rows[:, 0]] & flags[rows[:, 1]], axis=1)
+        k = int(np.sum(same)) # num edges within same community
+        l = len(rows) - k # num edges between communities
 
         t, p = two_samples_mean_ll_ratio(n, m, k, l, debug=True)
         # print("t-statistic: t = {:.3f}".format(t))
@@ -251,68 +259,88 @@ class FacebookGraph:
 
 
     def get_node_set(self):
-        origin_vertices = set([edge[0] for edge in self.edges])
-        destin_vertices = set([edge[1] for edge in self.edges])
-        return origin_vertices.union(destin_vertices)
+        return set(np.unique(self.edge_array).tolist())
 
     
     def get_node_has_feature_dict(self, feature_id):
-        node_set = self.get_node_set()
-        node_has_feature = {}
+        nodes = np.unique(self.edge_array)
+        has_feature = self.features.column(feature_id, self.node_rows(nodes))
+        return dict(zip(nodes.tolist(), has_feature.tolist()))
 
-        for node in node_set:
-            node_features = self.node_features.get(node)
-            if feature_id in node_features:
-                node_has_feature[node] = True
-            else:
-                node_has_feature[node] = False
 
-        return node_has_feature
+    def get_keyword_index(self):
+        """Feature ids by "-"-separated name segment (built once)"""
+        if self.keyword_index is None:
+            self.keyword_index = {}
+            for feature_id, feature_name in self.feature_names.items():
+                for segment in set(feature_name.split("-")):
+                    self.keyword_index.setdefault(segment, []).append(feature_id)
+        return self.keyword_index
+
+
+    def get_feat_ids(self, keywords):
+        """
+        Sorted ids of features matching any keyword
+        Keywords equal to a name segment use the keyword index, others fall back to substring search
+        """
+        keyword_index = self.get_keyword_index()
+        feature_ids = set()
+        for keyword in keywords:
+            if keyword in keyword_index:
+                feature_ids.update(keyword_index[keyword])
+            else:
+                feature_ids.update(feature_id for feature_id, feature_name in self.feature_names.items() if keyword in feature_name)
+        return sorted(feature_ids)
 
 
     def get_feat_ids_and_names(self, keywords=[], bias=True):
-        feat_ids_of_interest = []
-        feat_names_of_interest = []
-        
         if len(keywords) == 0:
-            feat_ids_of_interest.extend(self.feature_names.keys())
-            feat_names_of_interest.extend(self.feature_names.values())
+            feat_ids_of_interest = list(self.feature_names.keys())
         else:
-            for feature_id, feature_name in self.feature_names.items():
-                for keyword in keywords:
-                    if keyword in feature_name:
-                        feat_ids_of_interest.append(feature_id)
-                        feat_names_of_interest.append(feature_name)
-                        break
+            feat_ids_of_interest = self.get_feat_ids(keywords)
+
+        feat_names_of_interest = [self.feature_names[feature_id] for feature_id in feat_ids_of_interest]
         if bias == True:
             feat_names_of_interest.append("bias")
         feat_names_of_interest = np.array(feat_names_of_interest)
         return feat_ids_of_interest, feat_names_of_interest
 
 
-    def gradient_ascent(self, posterior_probs_dict, keywords=[]):
-        print("Performing gradient ascent...")
+    def design_matrix(self, feature_ids, values, bias=True):
+        """
+        Sparse design matrix and target vector in one step
 
-        feat_ids_of_interest, feat_names_of_interest = self.get_feat_ids_and_names(keywords)
+            Parameters:
+                feature_ids (int[]): feature columns of X
+                values (dict | float[]): target by node id, or array aligned with node_ids
+                bias (bool): append all-ones column
 
-        D = len(feat_ids_of_interest) + 1
-        X = -1 * np.ones((D, self.N)) # initialise as all -1 and only turn +Ve set features
+            Returns:
+                X (scipy.sparse.csr_matrix): (N x D) 0/1 design matrix, rows in node_ids order
+                t (float[]): (N) target vector
+        """
+        X = self.features.to_csr(columns=feature_ids)
+        if bias:
+            X = sp.hstack((X, sp.csr_matrix(np.ones((self.N, 1)))), format="csr")
 
-        node_id_arr = np.zeros(self.N)
-        t = np.empty((self.N, 1))
+        if isinstance(values, dict):
+            t = np.fromiter((values[node_id] for node_id in self.node_ids.tolist()), dtype=float, count=self.N)
+        else:
+            t = np.asarray(values, dtype=float)
+        return X, t
 
-        node_index = 0
-        # build X matrix and T array
-        for node_id, features in self.node_features.items():
-            node_id_arr[node_index] = node_id
-            prob = posterior_probs_dict[node_id]
-            t[node_index, 0] = 1 if prob > 0.5 else 0
 
-            for feat_index, feature_id in enumerate(feat_ids_of_interest):
-                if feature_id in features:
-                    X[feat_index, node_index] = 1
+    def gradient_ascent(self, posterior_probs_dict, keywords=[]):
+        print("Performing gradient ascent...")
 
-            node_index += 1
+        feat_ids_of_interest, feat_names_of_interest = self.get_feat_ids_and_names(keywords)
+
+        # +1 for set features, -1 otherwise (bias row is constant -1)
+        X_sparse, probs = self.design_matrix(feat_ids_of_interest, posterior_probs_dict, bias=False)
+        D = len(feat_ids_of_interest) + 1
+        X = -1 * np.ones((D, self.N))
+        X[:-1] = 2 * X_sparse.T.toarray() - 1
+        t = (probs > 0.5).astype(int).reshape(-1, 1)
 
         const = np.matmul(X, t - 1)
         w = np.random.randn(D, 1)
@@ -339,41 +367,22 @@ class FacebookGraph:
 
         feat_ids_of_interest, feat_names_of_interest = self.get_feat_ids_and_names(keywords)
 
-        D = len(feat_names_of_interest)
-        X = np.zeros((D, self.N)) # initialise as all -1 and only turn +Ve set features
-        X[-1, :] = np.ones(self.N)
+        # X already has constant column for bias
+        X, t = self.design_matrix(feat_ids_of_interest, output_dict)
+        w = lsqr(X, t)[0]
 
-        node_id_arr = np.zeros(self.N)
-        t = np.empty((self.N, 1))
-
-        node_index = 0
-        # build X matrix and t array
-        for node_id, features in self.node_features.items():
-            node_id_arr[node_index] = node_id
-            output = output_dict[node_id]
-            t[node_index, 0] = output
-
-            for feat_index, feature_id in enumerate(feat_ids_of_interest):
-                if feature_id in features:
-                    X[feat_index, node_index] = 1
-
-            node_index += 1
-
-        Xt = np.transpose(X)
-        regr = linear_model.LinearRegression(fit_intercept=False) # X already has constant term for bias
-        regr.fit(Xt, t)
-        r_squared = regr.score(Xt, t)
+        residuals = t - X @ w
+        r_squared = 1 - np.sum(residuals ** 2) / np.sum((t - np.mean(t)) ** 2)
         print("R^2 = {}".format(r_squared))
         self.plot_features(X, feat_names_of_interest, t)
-        self.plot_coeffs(regr.coef_[0], feat_names_of_interest)
+        self.plot_coeffs(w, feat_names_of_interest)
+        return w
 
 
     def plot_features(self, X, feat_names, t):
-        feature_totals = np.sum(X, axis=1)
-        feature_totals_in_comunity_one = np.zeros_like(feature_totals)
-        for i in range(0, self.N):
-            if t[i, 0] > 0:
-                feature_totals_in_comunity_one[:] += X[:, i]
+        """X: (N x D) design matrix, t: (N) target"""
+        feature_totals = np.asarray(X.sum(axis=0)).ravel()
+        feature_totals_in_comunity_one = np.asarray(X[t > 0].sum(axis=0)).ravel()
 
         fraction_in_community_one = np.divide(feature_totals_in_comunity_one, feature_totals)
         sorted_bar_plot(fraction_in_community_one, feat_names, "Community fractions", "Fraction of feature total in S")
@@ -403,3 +412,94 @@ class FacebookGraph:
         pretty_name = pretty_name.replace("anonymized_feature_", "")
         return pretty_name
 
+
+
+class CombinedFacebookGraph:
+    """
+    Union of all facebook egonets in facebook_dir
+
+    Egonets are parsed in a process pool and their features mapped into a global
+    vocabulary (by feature name), OR-ed for nodes appearing in several egonets.
+    The merged graph is cached in facebook_dir/combined.npz
+    """
+
+
+    def __init__(self, refresh=False, processes=None):
+        self.cache_path = os.path.join(facebook_dir, "combined.npz")
+        cached = None if refresh else load_npz(self.cache_path)
+
+        if cached is None:
+            cached = self.parse_egonets(processes)
+            atomic_savez(self.cache_path, **cached)
+
+        self.ego_ids = cached["ego_ids"]
+        self.node_ids = cached["node_ids"] # sorted
+        self.edge_array = cached["edge_array"] # (M x 2) node ids, undirected and deduplicated
+        self.feature_names = cached["feature_names"].tolist()
+        self.features = sp.csr_matrix(
+            (np.ones(len(cached["feature_indices"]), dtype=bool), cached["feature_indices"], cached["feature_indptr"]),
+            shape=(len(self.node_ids), len(self.feature_names))
+        ) # (N x D) row i belongs to node_ids[i]
+
+        # constants
+        self.N = len(self.node_ids)
+        self.M = len(self.edge_array)
+        self.D = len(self.feature_names)
+
+        self.edge_rows = self.node_rows(self.edge_array)
+        print("Combined {} egonets: N={}, M={}, D={}".format(len(self.ego_ids), self.N, self.M, self.D))
+
+
+    @staticmethod
+    def find_ego_ids():
+        return sorted(int(filename[:-len(".egofeat")]) for filename in os.listdir(facebook_dir) if filename.endswith(".egofeat"))
+
+
+    def parse_egonets(self, processes=None):
+        """Parses egonets concurrently and merges them, returning arrays to cache"""
+        ego_ids = self.find_ego_ids()
+        print("Parsing {} egonets...".format(len(ego_ids)))
+        with Pool(processes) as pool:
+            parsed = pool.map(_parse_egonet, ego_ids)
+
+        feature_names = sorted(set(name for _ids, _edges, names, _rows, _cols in parsed for name in names))
+        vocabulary = {name: col for col, name in enumerate(feature_names)}
+        node_ids = np.unique(np.concatenate([ids for ids, _edges, _names, _rows, _cols in parsed]))
+
+        edges = np.vstack([edge_array for _ids, edge_array, _names, _rows, _cols in parsed])
+        edges = np.unique(np.sort(edges, axis=1), axis=0)
+        edges = edges[edges[:, 0] != edges[:, 1]]
+
+        rows, cols = [], []
+        for ids, _edges, names, local_rows, local_cols in parsed:
+            global_cols = np.array([vocabulary[name] for name in names], dtype=np.int64)
+            rows.append(np.searchsorted(node_ids, ids[local_rows]))
+            cols.append(global_cols[local_cols])
+
+        features = sp.csr_matrix(
+            (np.ones(sum(len(r) for r in rows)), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(len(node_ids), len(feature_names))
+        ) # duplicates are summed, any non-zero is set
+        features.sum_duplicates()
+        features.sort_indices()
+
+        return {
+            "ego_ids": np.array(ego_ids, dtype=np.int64), "node_ids": node_ids, "edge_array": edges,
+            "feature_names": np.array(feature_names), "feature_indptr": features.indptr, "feature_indices": features.indices
+        }
+
+
+    def node_rows(self, node_ids):
+        """Feature rows of (array of) node ids"""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.node_ids, node_ids), self.N - 1)
+        if np.any(self.node_ids[rows] != node_ids):
+            raise KeyError("Unknown node ids")
+        return rows
+
+
+def _parse_egonet(ego_id):
+    """Worker: node ids, edges, feature names and (row, col) of set flags of one egonet"""
+    fb = FacebookGraph(ego_id)
+    rows, cols = np.nonzero(fb.features.to_dense(dtype=bool))
+    return fb.node_ids, fb.edge_array, fb.features.names, rows, cols
@@ -1,41 +1,66 @@
-import csv
 import os
+import numpy as np
+import pandas as pd
+from utils.storage import atomic_savez, load_npz
 
 
 curr_dir = os.path.dirname(__file__)
 names_dir = os.path.join(curr_dir, "names")
 
+# gender of code i is GENDER_CODES[i]
+GENDER_CODES = "UMF"
+
 
 class NameList:
+    """
+    Gender of first names from US baby name counts aggregated over years first_year..year
+    Stored as a sorted name array with a gender code per name, cached as .npz in names_dir
+    """
+
+    def __init__(self, year=2018, first_year=None, ratio=10, refresh=False):
+        first_year = year if first_year is None else first_year
+        self.ratio = ratio
+        cache_path = os.path.join(names_dir, "genders_{}_{}_{}.npz".format(first_year, year, ratio))
+
+        cached = None if refresh else load_npz(cache_path)
+        if cached is None:
+            names, codes = self._build_table(range(first_year, year + 1))
+            atomic_savez(cache_path, names=names, codes=codes)
+        else:
+            names, codes = cached["names"], cached["codes"]
+
+        self.names = names # sorted
+        self.codes = codes
 
-    def __init__(self, year=2018):
-        filename = "yob" + str(year) + ".txt"
-        filepath = os.path.join(names_dir, filename)
-        
-        female_names = {}
-        male_names = {}
 
-        with open(filepath) as csvfile:
-            reader = csv.reader(csvfile, delimiter=",")
-            for row in reader:
-                [name, gender, count] = row
-                if gender == "F":
-                    female_names[name] = int(count)
-                elif gender == "M":
-                    male_names[name] = int(count)
+    def _build_table(self, years):
+        """Sorted names and gender code of each (F / M if more than ratio times as common as other gender)"""
+        frames = []
+        for year in years:
+            filename = "yob" + str(year) + ".txt"
+            filepath = os.path.join(names_dir, filename)
+            frames.append(pd.read_csv(filepath, header=None, names=["name", "gender", "count"], keep_default_na=False))
 
-        self.female_names = female_names
-        self.male_names = male_names
+        counts = pd.concat(frames).pivot_table(index="name", columns="gender", values="count", aggfunc="sum", fill_value=0)
+        female_counts = counts["F"].to_numpy() if "F" in counts else np.zeros(len(counts), dtype=np.int64)
+        male_counts = counts["M"].to_numpy() if "M" in counts else np.zeros(len(counts), dtype=np.int64)
+
+        codes = np.full(len(counts), GENDER_CODES.index("U"), dtype=np.uint8)
+        codes[female_counts > male_counts * self.ratio] = GENDER_CODES.index("F")
+        codes[male_counts > female_counts * self.ratio] = GENDER_CODES.index("M")
+        return counts.index.to_numpy().astype(str), codes
+
+
+    def get_genders(self, names):
+        """Gender codes (index into GENDER_CODES) of array of names (0 / "U" if unknown)"""
+        names = np.asarray(names, dtype=str)
+        if len(self.names) == 0:
+            return np.zeros(names.shape, dtype=np.uint8)
+
+        positions = np.minimum(np.searchsorted(self.names, names), len(self.names) - 1)
+        found = self.names[positions] == names
+        return np.where(found, self.codes[positions], GENDER_CODES.index("U")).astype(np.uint8)
 
 
     def get_gender_of(self, name):
-        ratio = 10
-        female_count = self.female_names.get(name, 0)
-        male_count = self.male_names.get(name, 0)
-
-        if female_count > male_count * ratio:
-            return "F"
-        elif male_count > female_count * ratio:
-            return "M"
-        else:
-            return "U"
\ No newline at end of file
+        return GENDER_CODES[self.get_genders([name])[0]]
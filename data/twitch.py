@@ -1,7 +1,10 @@
 import os
-import csv
 import json
+import numpy as np
+import scipy.sparse as sp
 from model.graph_mcmc import Graph_MCMC
+from model.feature_store import FeatureStore
+from model.edges import read_edge_array
 
 
 curr_dir = os.path.dirname(__file__)
@@ -20,47 +23,48 @@ class TwitchGraph:
         self.feature_filename = "musae_" + country + "_features.json"
 
         self.edges = self.read_edges()
-        self.node_features = self.read_node_features()
+        self.node_ids, self.feature_ids, self.node_features = self.read_node_features()
 
     def read_edges(self):
-        delimiter = ","
-        edge_transform = lambda edge: (edge[0], edge[1])
+        """(M x 2) int array of edges"""
         filepath = os.path.join(twitch_dir, self.country, self.edge_filename)
-        
-        with open(filepath) as csvfile:
-            reader = csv.reader(csvfile, delimiter=delimiter)
-            reader.__next__() # discard header
-            rows = [edge_transform(row) for row in reader]
-        return rows
+        return read_edge_array(filepath, delimiter=",", skip_header=1)
 
     def read_node_features(self):
+        """
+        Returns sorted node ids, sorted feature ids and (N x F) CSR matrix of flags
+        (row i belongs to node_ids[i], column j to feature_ids[j])
+        """
         filepath = os.path.join(twitch_dir, self.country, self.feature_filename)
 
         with open(filepath) as jsonfile:
             features = json.load(jsonfile)
 
-        features = {key: val for key, val in features.items()}
-        return features            
+        node_ids = np.array([int(key) for key in features.keys()], dtype=np.int64)
+        lengths = np.array([len(val) for val in features.values()], dtype=np.int64)
+        feats = np.fromiter((feat for val in features.values() for feat in val), dtype=np.int64, count=np.sum(lengths))
+
+        feature_ids, cols = np.unique(feats, return_inverse=True)
+        rows = np.repeat(np.argsort(np.argsort(node_ids)), lengths)
+        matrix = sp.csr_matrix((np.ones(len(cols), dtype=bool), (rows, cols)), shape=(len(node_ids), len(feature_ids)))
+        return np.sort(node_ids), feature_ids, matrix
+
+    def feature_matrix(self, vertex_ids):
+        """(len(vertex_ids) x F) CSR flags, rows aligned with vertex_ids (empty for nodes without features)"""
+        vertex_ids = np.asarray(vertex_ids, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.node_ids, vertex_ids), len(self.node_ids) - 1)
+        found = self.node_ids[positions] == vertex_ids
+        matrix = sp.diags(found.astype(float)) @ self.node_features[positions]
+        matrix.eliminate_zeros()
+        return matrix.tocsr()
 
     
     def generate_mcmc_graph(self):
         graph = Graph_MCMC()
         graph.read_from_edges(self.edges)
 
-        feature_set = set()
-
-        for features in self.node_features.values():
-            feature_set = feature_set.union(features)
-
         vertices = graph.get_vertex_list()
-
-        for feat in feature_set:
-            readable_name = "feat-" + str(feat) 
-            value_arr = [feat in self.node_features[vertex] for vertex in vertices]
-            graph.add_property(readable_name, "bool", value_arr)
+        names = ["feat-" + str(feat) for feat in self.feature_ids]
+        graph.set_feature_store(FeatureStore.from_csr(names, self.feature_matrix(vertices)))
 
         return graph
-        
-
-
-
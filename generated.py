@@ -10,8 +10,9 @@ def run():
     # ml_classifier = graph.train_map_classifier()
     # ml_classifier.plot_final_weights(feature_names)
 
-    # mcmc_classifier = graph.sample_classifier_mcmc(100, True)
-    # mcmc_classifier.plot_sampled_weights(feature_names)
+    mcmc_classifier = graph.sample_classifier_mcmc(100, verbose=True)
+    mcmc_classifier.thin_samples()
+    mcmc_classifier.plot_sampled_weights(feature_names.copy())
 
     _B_max = graph.mcmc(10, verbose=True)
     marginal_classifier = graph.sample_classifier_marginals(2500, step_scaling=0.001, sigma=1, verbose=True)
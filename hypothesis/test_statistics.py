@@ -1,7 +1,7 @@
 """
 great website: https://machinelearningmastery.com/statistical-hypothesis-tests-in-python-cheat-sheet/ 
 """
-import math
+import numpy as np
 from distributions import chi_squared, gaussian
 
 
@@ -9,18 +9,20 @@ def bern_kl_divergence(p, q):
     """
     Returns the Kullback-Leibler Divergence between
     2 Bernoulli distributions with parameters p and q
-    D(Bern(p) || Bern(q))
+    D(Bern(p) || Bern(q)), elementwise for arrays
     """
     offset = 1E-10
-    p += offset
-    q += offset
-    return p * math.log(p / q) + (1-p) * math.log((1-p) / (1-q))
+    p = p + offset
+    q = q + offset
+    return p * np.log(p / q) + (1-p) * np.log((1-p) / (1-q))
 
 
 def two_samples_mean_ll_ratio(n, m, k, l, debug=False):
-    p_hat = k / float(n)
-    q_hat = l / float(m)
-    r_hat = (k + l) / float(n + m)
+    """Likelihood ratio test of k/n against l/m (arguments may be arrays)"""
+    n_f, m_f = np.asarray(n, dtype=float), np.asarray(m, dtype=float)
+    p_hat = k / n_f
+    q_hat = l / m_f
+    r_hat = (k + l) / (n_f + m_f)
 
     t = n * bern_kl_divergence(p_hat, r_hat) + m * \
         bern_kl_divergence(q_hat, r_hat)
@@ -37,13 +39,15 @@ def two_samples_mean_ll_ratio(n, m, k, l, debug=False):
 
 
 def students_z_test(n, m, k, l, debug=False):
-    p_hat = k / float(n)
-    q_hat = l / float(m)
-    r_hat = (k + l) / float(n + m)
-
-    var = r_hat * (1 - r_hat) * (1 / float(n) + 1 / float(m))
-    z = (p_hat - q_hat) / math.sqrt(var)
-    p = 2 * (1 - gaussian.cdf(abs(z))) 
+    """Two-sample z test of k/n against l/m (arguments may be arrays)"""
+    n_f, m_f = np.asarray(n, dtype=float), np.asarray(m, dtype=float)
+    p_hat = k / n_f
+    q_hat = l / m_f
+    r_hat = (k + l) / (n_f + m_f)
+
+    var = r_hat * (1 - r_hat) * (1 / n_f + 1 / m_f)
+    z = (p_hat - q_hat) / np.sqrt(var)
+    p = 2 * (1 - gaussian.cdf(np.abs(z))) 
 
     if debug:
         print("Population sizes:\n n = {} , m = {}\n".format(n, m))
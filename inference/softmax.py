@@ -7,6 +7,7 @@ from sklearn.preprocessing import OneHotEncoder
 from scipy.stats import norm
 import math
 from inference.store import Store, compute_log_acceptance_prob
+from utils.storage import atomic_savez, load_npz, rng_state_arrays, restore_rng_state
 from tqdm import tqdm
 from utils.colors import plt_color
 import matplotlib.mlab as mlab
@@ -139,18 +140,34 @@ class SoftmaxNeuralNet:
         """Initilaise SGLD - Stochastic Gradient Langevin Diffusion for MCMC sampling form posterior"""
         self.t = 0
 
-    def perform_mala(self, X, Y, num_iter=1000, step_scaling=1, verbose=False):
+    def perform_mala(self, X, Y, num_iter=1000, step_scaling=1, verbose=False, checkpoint=None, checkpoint_interval=1000, resume=None):
         """Performs Metropolis-Adjusted Langevin Algorithm
 
             Parameters:
                 X (int[][]): n x D matrix of feature flags
                 Y (int[][]): n x B matrix os posterior probs
                 num_iter (int): number of iterations to run
+                checkpoint (str): .npz path written every checkpoint_interval iterations
+                resume (str): checkpoint to continue from (also used as checkpoint if none given)
             Returns:
                 acceptance_ratio (float): fraction of samples accepted
                 accuracy (float): final accuracy on training set
         """
         self.n = X.shape[0]
+        start_t = 0
+        num_accepted = 0
+
+        resumed = None
+        if resume is not None:
+            resumed = load_npz(resume)
+            if resumed is None:
+                print("No checkpoint at {} >> starting afresh".format(resume))
+            if checkpoint is None:
+                checkpoint = resume
+
+        if resumed is not None:
+            start_t, num_accepted = self._restore_mala_checkpoint(resumed)
+            print("Resuming from iteration {}".format(start_t))
 
         initial_store = self.parameters.full_copy()
         A = self._forward(X, initial_store)
@@ -158,9 +175,7 @@ class SoftmaxNeuralNet:
         U = self._compute_minus_log_target(initial_store, A, Y)
         initial_store.set_U(U)
 
-        num_accepted = 0
-
-        for t in tqdm(range(0, num_iter)):
+        for t in tqdm(range(start_t, num_iter)):
             h = step_scaling * self.anneal_step_size(t, self.n)
 
             final_store = initial_store.full_copy()
@@ -184,6 +199,9 @@ class SoftmaxNeuralNet:
 
             self.store_history.append(initial_store.shallow_copy())
 
+            if checkpoint is not None and (t + 1) % checkpoint_interval == 0:
+                self._save_mala_checkpoint(checkpoint, initial_store, t + 1, num_accepted)
+
         acceptance_ratio = num_accepted / num_iter
         accuracy = self.accuracy(A, Y)
         if verbose:
@@ -192,6 +210,32 @@ class SoftmaxNeuralNet:
 
         return acceptance_ratio, accuracy
 
+    def _save_mala_checkpoint(self, filepath, store, t, num_accepted):
+        """Saves current chain position (store), sample history and RNG state"""
+        arrays = rng_state_arrays()
+        arrays["t"] = t
+        arrays["num_accepted"] = num_accepted
+        arrays["history_U"] = np.array([store.get_U() for store in self.store_history])
+
+        for l in range(1, self.L + 1):
+            arrays["W_" + str(l)] = store.get_W(l)
+            arrays["history_W_" + str(l)] = np.array([store.get_W(l) for store in self.store_history])
+
+        atomic_savez(filepath, **arrays)
+
+    def _restore_mala_checkpoint(self, arrays):
+        """Restores chain position into parameters, returns (t, num_accepted)"""
+        self.parameters = Store({l: arrays["W_" + str(l)] for l in range(1, self.L + 1)})
+
+        self.store_history = []
+        for i, U in enumerate(arrays["history_U"]):
+            store = Store({l: arrays["history_W_" + str(l)][i] for l in range(1, self.L + 1)})
+            store.set_U(float(U))
+            self.store_history.append(store)
+
+        restore_rng_state(arrays)
+        return int(arrays["t"]), int(arrays["num_accepted"])
+
     def sgld_iterate(self, X, Y, step_scaling=1):
         """Perform one iteration of sgld, returns previous cost"""
         self.n = X.shape[0]
@@ -741,3 +785,11 @@ def from_values_to_one_hot(y):
     enc = OneHotEncoder(sparse=False, categories='auto')
     y_hot = enc.fit_transform(y.reshape(len(y), -1))
     return y_hot
+
+
+def labels_to_one_hot(labels, width):
+    """Fixed-width one-hot encoding of integer labels in [0, width)"""
+    labels = np.asarray(labels)
+    y_hot = np.zeros((len(labels), width))
+    y_hot[np.arange(len(labels)), labels] = 1
+    return y_hot
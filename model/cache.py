@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+import numpy as np
+from utils.storage import atomic_savez, load_npz
+
+
+class ResultCache:
+    """
+    On-disk cache of inference results keyed by a content hash of their inputs
+    """
+
+    def __init__(self, cache_dir, enabled=True):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+
+
+    def key(self, kind, *parts):
+        """
+        Hashes kind plus any mix of arrays and json-serialisable args
+
+            Returns:
+                key (str): hex digest identifying the inputs
+        """
+        digest = hashlib.sha1(kind.encode())
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(str(part.dtype).encode())
+                digest.update(str(part.shape).encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(json.dumps(part, sort_keys=True, default=str).encode())
+        return kind + "-" + digest.hexdigest()
+
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+
+    def load(self, key):
+        if not self.enabled:
+            return None
+        return load_npz(self.path(key))
+
+
+    def save(self, key, **arrays):
+        if self.enabled:
+            atomic_savez(self.path(key), **arrays)
+
+
+    def invalidate(self, key=None):
+        """Removes one entry, or every entry if key is None"""
+        if key is not None:
+            filepath = self.path(key)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            return
+
+        if os.path.isdir(self.cache_dir):
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith(".npz"):
+                    os.remove(os.path.join(self.cache_dir, filename))
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+
+def intern_edges(edges, simple=True):
+    """
+    Maps external vertex ids to contiguous internal indices in one vectorized pass
+
+        Parameters:
+            edges (array-like): (M x 2+) int or str ids, extra columns ignored
+            simple (bool): drop self-loops and duplicate (undirected) edges
+
+        Returns:
+            internal_edges (int[][]): (M' x 2) edges between internal indices
+            vertex_ids (array): external id of each internal index (sorted)
+    """
+    edges = np.asarray(edges)
+    if edges.ndim != 2 or edges.shape[1] < 2:
+        raise ValueError("Expected (M x 2) array of edges, got shape {}".format(edges.shape))
+
+    vertex_ids, inverse = np.unique(edges[:, :2].ravel(), return_inverse=True)
+    internal_edges = inverse.reshape(-1, 2).astype(np.int64)
+
+    if simple:
+        internal_edges = simplify_edges(internal_edges, len(vertex_ids))
+
+    return internal_edges, vertex_ids
+
+
+def simplify_edges(edges, N):
+    """Removes self-loops and duplicate undirected edges from (M x 2) internal edges"""
+    lo = np.minimum(edges[:, 0], edges[:, 1])
+    hi = np.maximum(edges[:, 0], edges[:, 1])
+    keys = np.unique(lo[lo != hi] * N + hi[lo != hi])
+    return np.column_stack((keys // N, keys % N))
+
+
+def read_edge_array(filepath, delimiter=None, skip_header=0, dtype=np.int64, chunk_size=1000000):
+    """
+    Streams first two columns of an edge file in chunks into one (M x 2) array
+
+    Self-loops and repeated (undirected) edges within each chunk are dropped
+    as they are read so numeric files never hold more than one chunk of duplicates
+    """
+    sep = r"\s+" if delimiter is None else delimiter
+    reader = pd.read_csv(
+        filepath, sep=sep, header=None, skiprows=skip_header, usecols=[0, 1],
+        dtype=dtype, chunksize=chunk_size
+    )
+
+    chunks = []
+    for chunk in reader:
+        chunk_edges = chunk.to_numpy()
+        if np.issubdtype(chunk_edges.dtype, np.integer):
+            lo = chunk_edges.min(axis=1)
+            hi = chunk_edges.max(axis=1)
+            chunk_edges = np.unique(np.column_stack((lo, hi))[lo != hi], axis=0)
+        chunks.append(chunk_edges)
+
+    if len(chunks) == 0:
+        return np.empty((0, 2), dtype=dtype)
+    return np.concatenate(chunks)
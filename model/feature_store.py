@@ -0,0 +1,230 @@
+import numpy as np
+import scipy.sparse as sp
+import os
+
+
+class FeatureStore:
+    """
+    Columnar store of boolean vertex flags
+
+    Flags are bit-packed along the feature axis into a (N x ceil(D/8)) uint8
+    matrix, with a name <-> column index kept alongside. Row i corresponds to
+    vertex index i of the owning graph.
+    """
+
+    def __init__(self, names=None, packed=None, num_rows=0):
+        self.names = list(names) if names is not None else []
+        self.index = {name: col for col, name in enumerate(self.names)}
+
+        if packed is None:
+            packed = np.zeros((num_rows, _num_bytes(len(self.names))), dtype=np.uint8)
+
+        if packed.shape[1] != _num_bytes(len(self.names)):
+            raise ValueError("Packed width does not match number of features")
+
+        self.packed = packed
+
+
+    @classmethod
+    def from_dense(cls, names, matrix):
+        """Builds store from (N x D) matrix of flags (non-zero is set)"""
+        matrix = np.asarray(matrix) != 0
+        packed = np.packbits(matrix, axis=1)
+        return cls(names, packed)
+
+
+    @classmethod
+    def from_csr(cls, names, matrix):
+        """Builds store from (N x D) scipy sparse matrix (non-zero is set) without densifying"""
+        matrix = matrix.tocoo()
+        nonzero = matrix.data != 0
+        rows, cols = matrix.row[nonzero], matrix.col[nonzero]
+        packed = np.zeros((matrix.shape[0], _num_bytes(matrix.shape[1])), dtype=np.uint8)
+        np.bitwise_or.at(packed, (rows, cols >> 3), (0x80 >> (cols & 7)).astype(np.uint8))
+        return cls(names, packed)
+
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        """Loads store saved by save(), memory-mapping the packed matrix"""
+        packed = np.load(prefix + ".feat.npy", mmap_mode="r" if mmap else None)
+        with open(prefix + ".featnames.txt") as fp:
+            names = [line.rstrip("\n") for line in fp]
+        return cls(names, packed)
+
+
+    def save(self, prefix):
+        """Writes sidecar files <prefix>.feat.npy and <prefix>.featnames.txt"""
+        np.save(prefix + ".feat.npy", np.ascontiguousarray(self.packed))
+        with open(prefix + ".featnames.txt", "w") as fp:
+            for name in self.names:
+                fp.write(name + "\n")
+
+
+    @staticmethod
+    def exists(prefix):
+        return os.path.exists(prefix + ".feat.npy") and os.path.exists(prefix + ".featnames.txt")
+
+
+    # shape helpers
+    @property
+    def num_rows(self):
+        return self.packed.shape[0]
+
+
+    @property
+    def num_features(self):
+        return len(self.names)
+
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+
+    def column_index(self, name):
+        return self.index[name]
+
+
+    # views
+    def row_view(self, row):
+        """Packed bytes of a single row (no copy)"""
+        return self.packed[row]
+
+
+    def column_view(self, column):
+        """
+        Strided view of the byte column holding a feature (no copy)
+
+            Returns:
+                byte_column (uint8[]): view into packed matrix
+                mask (uint8): bit mask selecting feature within each byte
+        """
+        if isinstance(column, str):
+            column = self.index[column]
+        return self.packed[:, column >> 3], np.uint8(0x80 >> (column & 7))
+
+
+    def column(self, column, rows=None):
+        """Unpacks a single feature into a boolean array"""
+        byte_column, mask = self.column_view(column)
+        if rows is not None:
+            byte_column = byte_column[rows]
+        return (byte_column & mask) != 0
+
+
+    def to_dense(self, rows=None, columns=None, dtype=float):
+        """
+        Unpacks to (n x d) matrix
+
+            Parameters:
+                rows (int[]): row indices to select (default all)
+                columns (int[] | str[]): features to select (default all)
+                dtype: output dtype
+
+            Returns:
+                X (dtype[][]): dense feature matrix
+        """
+        packed = self.packed if rows is None else self.packed[rows]
+        dense = np.unpackbits(packed, axis=1, count=self.num_features)
+        if columns is not None:
+            columns = [self.index[c] if isinstance(c, str) else c for c in columns]
+            dense = dense[:, columns]
+        return dense.astype(dtype, copy=False)
+
+
+    def to_csr(self, rows=None, columns=None, dtype=float, chunk_size=65536):
+        """
+        Unpacks to (n x d) scipy CSR matrix, a chunk of rows at a time (never dense in full)
+
+            Parameters:
+                rows (int[]): row indices to select (default all)
+                columns (int[] | str[]): features to select (default all)
+                dtype: output dtype
+        """
+        packed = self.packed if rows is None else self.packed[rows]
+        if columns is not None:
+            columns = [self.index[c] if isinstance(c, str) else c for c in columns]
+        width = self.num_features if columns is None else len(columns)
+
+        row_parts, col_parts = [], []
+        for start in range(0, packed.shape[0], chunk_size):
+            dense = np.unpackbits(packed[start:start+chunk_size], axis=1, count=self.num_features)
+            if columns is not None:
+                dense = dense[:, columns]
+            chunk_rows, chunk_cols = np.nonzero(dense)
+            row_parts.append(chunk_rows + start)
+            col_parts.append(chunk_cols)
+
+        row_idx = np.concatenate(row_parts) if row_parts else np.zeros(0, dtype=np.int64)
+        col_idx = np.concatenate(col_parts) if col_parts else np.zeros(0, dtype=np.int64)
+        return sp.csr_matrix((np.ones(len(row_idx), dtype=dtype), (row_idx, col_idx)), shape=(packed.shape[0], width))
+
+
+    def column_counts(self, rows=None):
+        """Number of set flags per feature"""
+        packed = self.packed if rows is None else self.packed[rows]
+        counts = np.zeros(self.num_features, dtype=np.int64)
+        for byte in range(packed.shape[1]):
+            bits = np.unpackbits(packed[:, byte:byte+1], axis=1)
+            width = min(8, self.num_features - 8 * byte)
+            counts[8*byte:8*byte+width] = bits[:, :width].sum(axis=0)
+        return counts
+
+
+    # mutation
+    def add_columns(self, names, matrix):
+        """Appends (N x k) flags as new named columns"""
+        names = list(names)
+        for name in names:
+            if name in self.index:
+                raise ValueError("Feature already exists: " + name)
+
+        matrix = np.asarray(matrix) != 0
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(-1, 1)
+
+        if self.num_rows == 0 and self.num_features == 0:
+            self.packed = np.zeros((matrix.shape[0], 0), dtype=np.uint8)
+        if matrix.shape[0] != self.num_rows:
+            raise ValueError("Expected {} rows, got {}".format(self.num_rows, matrix.shape[0]))
+
+        dense = np.unpackbits(self.packed, axis=1, count=self.num_features).astype(bool)
+        self.packed = np.packbits(np.hstack((dense, matrix)), axis=1)
+        self.names.extend(names)
+        self.index = {name: col for col, name in enumerate(self.names)}
+
+
+    def remove_column(self, name):
+        if name not in self.index:
+            return False
+        keep = [col for col in range(self.num_features) if col != self.index[name]]
+        dense = np.unpackbits(self.packed, axis=1, count=self.num_features)[:, keep]
+        self.packed = np.packbits(dense, axis=1)
+        self.names.remove(name)
+        self.index = {name: col for col, name in enumerate(self.names)}
+        return True
+
+
+    def rename_column(self, old_name, new_name):
+        if old_name not in self.index or new_name in self.index:
+            return False
+        col = self.index.pop(old_name)
+        self.names[col] = new_name
+        self.index[new_name] = col
+        return True
+
+
+    def take_rows(self, rows):
+        """Returns new store restricted to given rows (index array or mask)"""
+        return FeatureStore(self.names, self.packed[rows])
+
+
+    def append_rows(self, num_rows):
+        """Appends num_rows all-unset rows"""
+        zeros = np.zeros((num_rows, self.packed.shape[1]), dtype=np.uint8)
+        self.packed = np.vstack((self.packed, zeros))
+
+
+def _num_bytes(num_features):
+    return (num_features + 7) // 8
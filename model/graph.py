@@ -1,105 +1,130 @@
 import numpy as np
 from tqdm import tqdm
 import math
+from collections import deque
+import scipy.sparse as sp
 
 import networkx as nx
 import matplotlib.pyplot as plt
 from utils.colors import color_between
+from model.spectral import spectral_embedding, spectral_partition
 
 
 class Graph:
 
     def __init__(self, edges):
 
-        origin_vertices = set([edge[0] for edge in edges])
-        destin_vertices = set([edge[1] for edge in edges])
-
-        vertex_set = origin_vertices.union(destin_vertices)
+        edges_arr = np.asarray(edges).reshape(-1, 2)
         
+        # relabel vertices with an index, in order of first appearance
+        vertices, first, inverse = np.unique(edges_arr.reshape(-1), return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        pairs = rank[inverse].reshape(-1, 2)
+
         # constants
-        self.N = len(vertex_set)
-        self.M = len(edges)
+        self.N = len(vertices)
+        self.M = len(edges_arr)
 
         # edges
         self.edges_raw = edges
+        self.edge_index = pairs # (M x 2) edges as vertex indices
 
-        # relabel vertices with an index
-        self.index_to_vertex = {}
-        self.vertex_to_index = {}
+        self.index_to_vertex = dict(enumerate(vertices[order].tolist()))
+        self.vertex_to_index = {vertex: index for index, vertex in self.index_to_vertex.items()}
 
-        for index, vertex in enumerate(vertex_set):
-            self.index_to_vertex[index] = vertex
-            self.vertex_to_index[vertex] = index
+        # CSR adjacency of simple undirected graph, neighbours sorted
+        keys = np.unique(np.concatenate((pairs[:, 0] * self.N + pairs[:, 1], pairs[:, 1] * self.N + pairs[:, 0])))
+        self.indices = keys % self.N
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(keys // self.N, minlength=self.N))))
+        self._adjacency_matrix = None
 
-        self.adjacency_list = [set() for v in range(0, self.N)]
-        self.adjacency_matrix = np.zeros((self.N, self.N))
+        self.assignments = None
+        print("Initialised graph with N={} nodes and M={} edges".format(self.N, self.M))
 
-        for edge in edges:
-            a = self.vertex_to_index.get(edge[0])
-            b = self.vertex_to_index.get(edge[1])
 
-            self.adjacency_list[a].add(b)
-            self.adjacency_list[b].add(a)
+    @property
+    def adjacency_matrix(self):
+        """Dense (N x N) edge counts (both directions), built on first use"""
+        if self._adjacency_matrix is None:
+            matrix = np.zeros((self.N, self.N))
+            np.add.at(matrix, (self.edge_index[:, 0], self.edge_index[:, 1]), 1)
+            np.add.at(matrix, (self.edge_index[:, 1], self.edge_index[:, 0]), 1)
+            self._adjacency_matrix = matrix
+        return self._adjacency_matrix
 
-            self.adjacency_matrix[a, b] += 1
-            self.adjacency_matrix[b, a] += 1
 
-        self.assignments = None
-        print("Initialised graph with N={} nodes and M={} edges".format(self.N, self.M))
+    def neighbours(self, v):
+        """Sorted neighbour indices of vertex index v (view into CSR arrays)"""
+        return self.indices[self.indptr[v]:self.indptr[v+1]]
+
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+
+    def abp(self, seed=None, num_inits=1, exact_init=False):
+        """
+        Acyclic belief propagation (r = 3) for two communities
 
+            Parameters:
+                seed (int): numpy seed for initial messages
+                num_inits (int): independent random initialisations run together
+                exact_init (bool): draw initial messages on all N^2 pairs (O(N^2) time), reproducing
+                    the original dense implementation, rather than on the 2M directed edges only
 
-    def abp(self, seed=None):
+            Returns:
+                output_by_vertex (dict): vertex -> score in [-1, 1] (array of num_inits scores if num_inits > 1)
+        """
         if seed is not None:
             np.random.seed(seed)
         # implement for r = 3
         r = 3
         T = math.floor(math.log2(self.N)) # num_iters - r
 
-        y = np.zeros((T, self.N, self.N)) # y[t, i, j] is message at time t from i -> j
-        z = np.zeros((T, self.N, self.N)) # z[t, i, j] is normalised message at t from i -> j
-        
-        # random initial setting
-        y[r-1, :, :] = np.random.normal(size=(self.N, self.N))
+        # messages live on directed edges e: src[e] -> indices[e], rows of CSR structure
+        indptr, indices = self.indptr, self.indices
+        src = np.repeat(np.arange(self.N), np.diff(indptr))
+        rev = self._reverse_edges(indptr, indices, src)
+        E = len(indices)
+
+        # rows: vertex, columns: edges out of it (sums over messages into vertex via rev)
+        row_sum = sp.csr_matrix((np.ones(E), np.arange(E), indptr), shape=(self.N, E))
+        tri_e, tri_f = self._triangle_index(indptr, indices, src)
+        triangles = sp.csr_matrix((np.ones(len(tri_e)), (tri_e, tri_f)), shape=(E, E))
+
+        y, y_sum = self._initial_messages(indptr, indices, num_inits, exact_init) # y[e, k] message at time t-1
+
+        if T < r:
+            y = np.zeros((E, num_inits))
+
+        # z for the last r time steps only, most recent first (steps before r-1 are zero)
+        z_window = deque([np.zeros((E, num_inits)) for _ in range(r)], maxlen=r)
 
         for t in tqdm(range(r, T)):
-            s = np.sum(y[t-1, :, :]) / (2 * self.M)
-            z[t-1, :, :] = y[t-1, :, :] - s
-
-            for v in range(0, self.N):
-                vd_set = self.adjacency_list[v]
-                
-                for vd in vd_set:
-                    y_vd_to_v = 0
-                    vdd_set = self.adjacency_list[vd].difference({v})
-
-                    for vdd in vdd_set:
-                        y_vd_to_v += z[t-1, vdd, vd]
-
-                        if vdd in vd_set:
-                            # part of 3-cycle
-                            y_vd_to_v -= z[t-3, vdd, v]
-                    
-                    y[t, vd, v] = y_vd_to_v
-
-        output = np.zeros(self.N)
-        for v in range(0, self.N):
-            vd_set = self.adjacency_list[v]
-
-            for vd in vd_set:
-                output[v] += y[T-1, vd, v]
-
-        pos_max = np.max(output)
-        neg_max = np.abs(np.min(output))
-        for v in range(0, self.N):
-            if output[v] > 0:
-                output[v] = output[v] / pos_max
-            else:
-                output[v] = output[v] / neg_max
+            s = y_sum / (2 * self.M)
+            z_window.appendleft(y - s)
+            z_prev, z_prev_3 = z_window[0], z_window[r-1]
+
+            # non-backtracking sum into src[e] excluding reverse edge, minus 3-cycle correction
+            in_sum = row_sum @ z_prev[rev]
+            y = in_sum[src] - z_prev[rev] - triangles @ z_prev_3
+            y_sum = np.sum(y, axis=0)
+
+        output = row_sum @ y[rev]
+
+        pos_max = np.max(output, axis=0)
+        neg_max = np.abs(np.min(output, axis=0))
+        output = np.where(output > 0, output / pos_max, output / neg_max)
+
+        if num_inits == 1:
+            output = output[:, 0]
 
         self.output = output
         self.assignments = (output > 0).astype(int)
 
-        community_one_ratio = np.sum(self.assignments) / self.N
+        community_one_ratio = np.sum(self.assignments, axis=0) / self.N
         print("Partitioned such that p={} in community 1".format(community_one_ratio))
 
         output_by_vertex = {}
@@ -110,6 +135,100 @@ class Graph:
         return output_by_vertex
 
 
+    def spectral(self, k=2, seed=None):
+        """
+        Bethe Hessian spectral communities (k-means on leading eigenvectors for k > 2)
+
+            Parameters:
+                k (int): number of communities, estimated from the spectrum if None
+                seed (int): seed for k-means
+
+            Returns:
+                output_by_vertex (dict): vertex -> score in [-1, 1] for k = 2 (sign gives community),
+                    else row of the (N x k) spectral embedding
+        """
+        adjacency = sp.csr_matrix((np.ones(len(self.indices)), self.indices, self.indptr), shape=(self.N, self.N))
+
+        if k == 2:
+            _values, vectors = spectral_embedding(adjacency, k=2)
+            output = vectors[:, 1]
+            output = np.where(output > 0, output / np.max(output), output / np.abs(np.min(output)))
+            self.assignments = (output > 0).astype(int)
+        else:
+            self.assignments, output = spectral_partition(adjacency, k=k, seed=seed)
+
+        self.output = output
+        print("Partitioned into communities of sizes {}".format(np.bincount(self.assignments)))
+
+        output_by_vertex = {}
+        
+        for vertex, index in self.vertex_to_index.items():
+            output_by_vertex[vertex] = self.output[index]
+
+        return output_by_vertex
+
+
+    def _reverse_edges(self, indptr, indices, src):
+        """rev[e] is index of edge indices[e] -> src[e]"""
+        keys = src * self.N + indices # sorted as rows and neighbours are
+        return np.searchsorted(keys, indices * self.N + src)
+
+
+    def _triangle_index(self, indptr, indices, src, chunk_size=1000000):
+        """
+        Pairs (e, f) with e = vd -> v and f = vdd -> v for every vdd in N(vd) \ {v} also in N(v)
+        Wedges vdd - vd - v are expanded in chunks of about chunk_size
+        """
+        keys = src * self.N + indices
+        wedges = np.diff(indptr)[src] # candidate vdd per edge
+        wedge_end = np.cumsum(wedges)
+        E = len(indices)
+
+        tri_e, tri_f = [], []
+        a = 0
+        while a < E:
+            b = max(a + 1, np.searchsorted(wedge_end, wedge_end[a] - wedges[a] + chunk_size, side="right"))
+            counts = wedges[a:b]
+            e = np.repeat(np.arange(a, b), counts)
+            offsets = np.arange(len(e)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+            vdd = indices[indptr[src[e]] + offsets]
+            v = indices[e]
+            keep = vdd != v
+            e, vdd, v = e[keep], vdd[keep], v[keep]
+
+            target = vdd * self.N + v
+            f = np.minimum(np.searchsorted(keys, target), E - 1)
+            hit = keys[f] == target
+            tri_e.append(e[hit])
+            tri_f.append(f[hit])
+            a = b
+
+        if E == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(tri_e), np.concatenate(tri_f)
+
+
+    def _initial_messages(self, indptr, indices, num_inits, exact_init):
+        """
+        Gaussian messages on directed edges and their sum (per initialisation)
+        exact_init draws a full (N x N) matrix per initialisation, row by row
+        """
+        E = len(indices)
+        if not exact_init:
+            y = np.random.normal(size=(E, num_inits))
+            return y, np.sum(y, axis=0)
+
+        y = np.zeros((E, num_inits))
+        y_sum = np.zeros(num_inits) # messages on non-edges count towards s
+        for k in range(0, num_inits):
+            for i in range(0, self.N):
+                row = np.random.normal(size=self.N)
+                y_sum[k] += np.sum(row)
+                y[indptr[i]:indptr[i+1], k] = row[indices[indptr[i]:indptr[i+1]]]
+        return y, y_sum
+
+
     def draw_standard(self, custom_labels={}, title="", feature=""):
         node_color = self.build_color_arr(custom_labels)
 
@@ -1,19 +1,45 @@
 from graph_tool.inference.blockmodel import BlockState
 import numpy as np
 # version focal seems to be winner
-from graph_tool import Graph as GT_Graph
+from graph_tool import Graph as GT_Graph, GraphView, seed_rng
+from graph_tool.topology import kcore_decomposition
 # X-server must be running else import will timeout
-from graph_tool.draw import graph_draw
-from graph_tool.inference import minimize_blockmodel_dl, mcmc_equilibrate, PartitionModeState, NestedBlockState
+from graph_tool.draw import graph_draw, sfdp_layout
+from graph_tool.inference import minimize_blockmodel_dl, minimize_nested_blockmodel_dl, mcmc_equilibrate, PartitionModeState, NestedBlockState
 from graph_tool.collection import data, ns
+from graph_tool.spectral import adjacency as spectral_adjacency
 import matplotlib.pyplot as plt
-from inference.softmax import SoftmaxNeuralNet, from_values_to_one_hot
+from inference.softmax import SoftmaxNeuralNet, labels_to_one_hot
+from model.feature_store import FeatureStore
+from model.graph import Graph
+from model.spectral import spectral_partition
+from model.cache import ResultCache
+from model.edges import intern_edges, read_edge_array
+from utils.storage import atomic_savez, load_npz, rng_state_arrays, restore_rng_state
 from data.utils import get_misc_path
+from utils.subsampling import random_index_arr, stratified_index_arr, k_fold_index_arrs
+from utils.convergence import detect_burn_in, label_counts, marginal_entropy, match_labels, total_variation
 from tqdm import tqdm
+from multiprocessing import Pool
+import operator
 import os
 
 curr_dir = os.path.dirname(__file__)
 output_dir = os.path.join(curr_dir, "..", "output")
+cache_dir = os.path.join(output_dir, "cache")
+
+EDGE_COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+
+def _gt_filename(name):
+    return name if name.endswith(".gt") else name + ".gt"
 
 
 def gen_output_path(filename):
@@ -26,20 +52,34 @@ def gen_output_path(filename):
 class Graph_MCMC:
 
 
-    def __init__(self):
+    def __init__(self, use_cache=True):
         """Initialises empty graph"""
         self.G = GT_Graph(directed=False)
         
         # initialise empty state
         self.state = None
+        self.nested_state = None # hierarchy above state when fitted in nested mode
         self.vertex_block_counts = None
         self.B_max = None
-        self.relabelled_vertices = None
+        self.marginal_counts = None
+        self.level_marginal_counts = None
+        self.pmode = None
+        self.deg_corr = True
+        self.num_vertex_moves = 0 # attempted vertex moves in last mcmc run
+        self.dl_table = None # rows of (B, restart, DL) from last partition
+        self.draw_state = None # nested state used for circular drawing
+        self.vertex_ids = None # external id of each vertex index
+
+        # bit-packed boolean features (rows aligned with vertex index)
+        self.features = None
 
         # treat prior on b as uniform
         self.entropy_args = {"partition_dl": False}
         self.mcmc_args = {"entropy_args": self.entropy_args}
 
+        # seeded partition / mcmc results keyed by graph hash and arguments
+        self.cache = ResultCache(cache_dir, enabled=use_cache)
+
 
     # print helpers
     def print_info(self):
@@ -51,6 +91,8 @@ class Graph_MCMC:
     
     def print_props(self):
         print("All vertex props: " + str(set(self.G.vertex_properties.keys())))
+        if self.features is not None:
+            print("Packed feature flags: {} ({} bytes)".format(self.features.num_features, self.features.nbytes))
         print("Training vertex props: " + str(self.get_feature_names()))
 
     
@@ -59,13 +101,41 @@ class Graph_MCMC:
 
 
     # read helpers
-    def read_from_edges(self, edges):
-        """Initialises graph based on edges"""
-        self.relabelled_vertices = self.G.add_edge_list(edges, hashed=True)
+    def read_from_edges(self, edges, simple=True):
+        """
+        Initialises graph based on edges
+
+            Parameters:
+                edges (array-like): (M x 2) int or str external vertex ids
+                simple (bool): drop self-loops and duplicate edges
+        """
+        internal_edges, self.vertex_ids = intern_edges(edges, simple=simple)
+        self.G.add_vertex(len(self.vertex_ids))
+        self.G.add_edge_list(internal_edges)
+
+
+    def read_from_edge_file(self, filepath, delimiter=None, skip_header=0, dtype=np.int64, chunk_size=1000000):
+        """Initialises graph from first two columns of an edge file, read in chunks"""
+        edges = read_edge_array(filepath, delimiter=delimiter, skip_header=skip_header, dtype=dtype, chunk_size=chunk_size)
+        self.read_from_edges(edges)
 
     def read_from_file(self, filename):
-        filename = get_misc_path(filename)
-        self.G.load(filename)
+        self._load_graph_file(get_misc_path(filename))
+
+
+    def read_from_saved(self, name):
+        """Loads graph (and feature sidecar) written by save_to_file(name)"""
+        self._load_graph_file(gen_output_path(_gt_filename(name)))
+
+
+    def _load_graph_file(self, filepath):
+        """Loads graph file, with feature store sidecar keyed by the same path if present"""
+        self.G.load(filepath)
+
+        if FeatureStore.exists(filepath):
+            self.features = FeatureStore.load(filepath)
+        elif filepath.endswith(".gt"):
+            print("Warning: no feature store found for {} >> graph has no packed features".format(filepath))
 
     
     def read_from_gt(self, dataset_name):
@@ -80,50 +150,248 @@ class Graph_MCMC:
     
     # save helpers
     def save_to_file(self, name):
-        filename = gen_output_path(name)
+        """Writes output/<name>.gt and feature store sidecars output/<name>.gt.feat*"""
+        filename = gen_output_path(_gt_filename(name))
         self.G.save(filename, fmt="gt")
 
+        if self.features is not None:
+            self.features.save(filename)
+
 
     # filter
-    def filter_out_low_degree(self, min_degree):
-        """Removes all vertices with degree strictly less than min_degree"""
+    def filter_out_low_degree(self, min_degree, iterate=False, materialise=True):
+        """
+        Removes all vertices with degree strictly less than min_degree
+
+            Parameters:
+                min_degree (int): minimum degree kept
+                iterate (bool): keep pruning until no vertex falls below min_degree (k-core)
+                materialise (bool): prune now, else leave a filtered view (see materialise)
+        """
         vertices = self.G.get_vertices()
-        degree_arr = self.G.get_total_degrees(vertices)
-        
-        remove_arr = []
-        for idx, degree in enumerate(degree_arr):
-            if degree < min_degree:
-                remove_arr.append(idx)
-        
-        self.G.remove_vertex(remove_arr)
+        keep = np.zeros(self.G.num_vertices(ignore_filter=True), dtype=bool)
+
+        if iterate:
+            core = kcore_decomposition(self.G).a
+            keep[vertices] = core[vertices] >= min_degree
+        else:
+            keep[vertices] = self.G.get_total_degrees(vertices) >= min_degree
+
+        self.G = GraphView(self.G, vfilt=self.G.new_vertex_property("bool", keep))
+
+        if materialise:
+            self.materialise()
 
     
     def filter_edges(self, property_name, value_to_keep):
-        prop_map = self.G.edge_properties[property_name]
-        filter_arr = [value == value_to_keep for value in prop_map.get_array()]
-        filter_map = self.G.new_edge_property("bool", filter_arr)
-        self.G.set_edge_filter(filter_map)
+        self.filter_edges_by([(property_name, "==", value_to_keep)])
+
+
+    def filter_edges_by(self, predicates, materialise=False):
+        """
+        Hides all edges failing any predicate (on top of existing filters)
+
+            Parameters:
+                predicates ((str, str, any)[]): (edge property, comparison, value)
+                    e.g. [("layer", "==", 1), ("weight", ">=", 2)]
+                materialise (bool): prune now, else leave a filtered view
+        """
+        keep = np.ones(self.G.edge_index_range, dtype=bool)
+        for property_name, comparison, value in predicates:
+            values = self.G.edge_properties[property_name].a
+            keep &= EDGE_COMPARISONS[comparison](values, value)
+
+        self.G = GraphView(self.G, efilt=self.G.new_edge_property("bool", keep))
+
+        if materialise:
+            self.materialise()
+
+
+    def materialise(self):
+        """Replaces filtered view with a new graph holding only visible vertices and edges"""
+        kept = self.G.get_vertices()
+        state_arrays = self._state_arrays() if self.state is not None else None
 
+        self.G = GT_Graph(self.G, prune=True)
 
-    def add_ego_node(self):
+        if self.vertex_ids is not None:
+            self.vertex_ids = self.vertex_ids[kept]
+
+        if self.features is not None:
+            self.features = self.features.take_rows(kept)
+
+        if state_arrays is not None:
+            state_arrays["b"] = state_arrays["b"][kept]
+            self._restore_state(state_arrays)
+
+        if self.level_marginal_counts is not None:
+            self._set_marginal_counts([counts[kept] for counts in self.level_marginal_counts])
+
+
+    def add_ego_node(self, ego_id=None):
+        """Adds vertex joined to every other vertex (ego_id defaults to max id + 1)"""
         vertices = self.G.get_vertices()
-        v = self.G.add_vertex()
-        edges = []
-        for dest in vertices:
-            edges.append((v, dest))
+        v = int(self.G.add_vertex())
+        edges = np.column_stack((np.full(len(vertices), v), vertices))
 
         self.G.add_edge_list(edges)
 
+        if self.vertex_ids is not None:
+            if ego_id is None:
+                ego_id = self.vertex_ids.max() + 1 if np.issubdtype(self.vertex_ids.dtype, np.integer) else "ego"
+            self.vertex_ids = np.append(self.vertex_ids, ego_id)
+
+        if self.features is not None:
+            self.features.append_rows(1)
+
 
     def get_vertex_list(self):
         """Returns external view of vertices"""
         internal_vertices = self.G.get_vertices()
-        if self.relabelled_vertices is not None:
-            return [self.relabelled_vertices[vertex] for vertex in internal_vertices]
+        if self.vertex_ids is not None:
+            return self.vertex_ids[internal_vertices]
         else:
             return internal_vertices
 
 
+    # streaming updates
+    def update(self, edges=None, vertex_ids=None, num_sweeps=10, hops=1, num_iter=100, burn_in=0.20, thinning=5, verbose=False):
+        """
+        Adds a batch of edges / vertices (external ids) warm-starting from the current partition
+
+        New vertices are seeded with the majority block of their neighbours, then
+        num_sweeps sweeps and a num_iter sample refresh of the marginals are run
+        only over vertices within hops of the batch (marginals of all other vertices are kept)
+
+            Returns:
+                region (int[]): vertex indices re-sampled
+        """
+        if self.vertex_ids is None:
+            raise ValueError("Streaming updates need external ids (use read_from_edges)")
+        if self.nested_state is not None:
+            raise ValueError("Streaming updates are only supported in flat mode")
+
+        N_old = self.G.num_vertices(ignore_filter=True)
+        edges = np.empty((0, 2), dtype=self.vertex_ids.dtype) if edges is None else np.asarray(edges)[:, :2]
+        vertex_ids = np.empty(0, dtype=self.vertex_ids.dtype) if vertex_ids is None else np.asarray(vertex_ids)
+
+        internal_vertices = self._intern_ids(np.concatenate((edges.ravel(), vertex_ids)))
+        internal_edges = internal_vertices[:2*len(edges)].reshape(-1, 2)
+        internal_edges = self._drop_known_edges(internal_edges, N_old)
+        self.G.add_edge_list(internal_edges)
+
+        num_new = self.G.num_vertices(ignore_filter=True) - N_old
+        if self.features is not None:
+            self.features.append_rows(num_new)
+
+        if self.state is None:
+            return np.unique(internal_vertices)
+
+        B = self.state.get_B()
+        b = np.concatenate((self.state.b.a[:N_old], self._seed_new_blocks(internal_edges, N_old, num_new, B)))
+        self.state = BlockState(self.G, b=self._to_vertex_property(b), B=B, deg_corr=self.deg_corr)
+
+        region = self._neighbourhood(np.unique(internal_vertices), hops)
+        if verbose:
+            print("Added {} vertices and {} edges, re-sampling {} vertices".format(num_new, len(internal_edges), len(region)))
+
+        self.state.mcmc_sweep(niter=num_sweeps, d=0.00, entropy_args=self.entropy_args, vertices=region)
+        if self.marginal_counts is not None:
+            self._refresh_marginals(region, num_iter, burn_in, thinning, verbose)
+        return region
+
+
+    def _refresh_marginals(self, region, num_iter, burn_in, thinning, verbose):
+        """
+        Re-estimates marginals of region vertices only, keeping the counts of all others
+        Labels of the refresh are matched to the kept marginals through the vertices held fixed
+        """
+        old_counts = self.marginal_counts
+        self.mcmc(num_iter=num_iter, burn_in=burn_in, thinning=thinning, verbose=verbose, vertices=region)
+        new_counts = self.marginal_counts
+
+        # old counts plus zero rows for the new vertices
+        N_old, B_old = old_counts.shape
+        counts = np.zeros((new_counts.shape[0], B_old), dtype=np.int64)
+        counts[:N_old] = old_counts
+
+        fixed = np.setdiff1d(self.G.get_vertices(), region)
+        fixed = fixed[fixed < N_old]
+        if len(fixed) == 0:
+            self._set_marginal_counts([new_counts])
+            return
+
+        # vertices outside region never moved, so their refreshed labels pin the relabelling
+        mapping = match_labels(np.argmax(new_counts[fixed], axis=1), np.argmax(old_counts[fixed], axis=1), new_counts.shape[1], B_old)
+        B = max(B_old, int(mapping.max()) + 1)
+        counts = np.hstack((counts, np.zeros((len(counts), B - B_old), dtype=np.int64)))
+
+        counts[region] = 0
+        counts[np.ix_(region, mapping)] = new_counts[region]
+        self._set_marginal_counts([counts])
+
+
+    def _intern_ids(self, ids):
+        """Internal indices of external ids, adding vertices for unseen ids"""
+        sorter = np.argsort(self.vertex_ids)
+        pos = np.searchsorted(self.vertex_ids, ids, sorter=sorter)
+        pos = np.minimum(pos, len(self.vertex_ids) - 1)
+        found = self.vertex_ids[sorter[pos]] == ids if len(self.vertex_ids) > 0 else np.zeros(len(ids), dtype=bool)
+
+        internal = np.empty(len(ids), dtype=np.int64)
+        internal[found] = sorter[pos[found]]
+
+        new_ids, new_inverse = np.unique(ids[~found], return_inverse=True)
+        internal[~found] = len(self.vertex_ids) + new_inverse
+        if len(new_ids) > 0:
+            self.G.add_vertex(len(new_ids))
+            self.vertex_ids = np.concatenate((self.vertex_ids, new_ids))
+        return internal
+
+
+    def _drop_known_edges(self, internal_edges, N_old):
+        """Removes self-loops, repeats and edges already present between old vertices"""
+        lo = np.minimum(internal_edges[:, 0], internal_edges[:, 1])
+        hi = np.maximum(internal_edges[:, 0], internal_edges[:, 1])
+        pairs = np.unique(np.column_stack((lo, hi))[lo != hi], axis=0)
+
+        both_old = pairs[:, 1] < N_old
+        known = np.zeros(len(pairs), dtype=bool)
+        known[both_old] = [self.G.edge(u, v) is not None for u, v in pairs[both_old]]
+        return pairs[~known]
+
+
+    def _seed_new_blocks(self, internal_edges, N_old, num_new, B):
+        """Majority block of already placed neighbours, propagated through new vertices"""
+        b = np.concatenate((self.state.b.a[:N_old], np.full(num_new, -1)))
+        src = np.concatenate((internal_edges[:, 0], internal_edges[:, 1]))
+        dst = np.concatenate((internal_edges[:, 1], internal_edges[:, 0]))
+
+        while True:
+            pending = (b[src] < 0) & (b[dst] >= 0)
+            if not pending.any():
+                break
+
+            keys, counts = np.unique(src[pending] * B + b[dst[pending]], return_counts=True)
+            vertices, blocks = keys // B, keys % B
+            order = np.lexsort((-counts, vertices))
+            _vertices, first = np.unique(vertices[order], return_index=True)
+            b[vertices[order][first]] = blocks[order][first]
+
+        # vertices with no placed neighbours join the largest block
+        b[b < 0] = np.argmax(np.bincount(self.state.b.a[:N_old], minlength=B))
+        return b[N_old:]
+
+
+    def _neighbourhood(self, vertices, hops):
+        region = set(vertices.tolist())
+        frontier = region
+        for _hop in range(0, hops):
+            frontier = {int(u) for v in frontier for u in self.G.get_all_neighbors(v)} - region
+            region |= frontier
+        return np.array(sorted(region), dtype=np.int64)
+
+
     # property methods
     def add_property(self, name, value_type, value_sequence):
         vertex_prop = self.G.new_vertex_property(value_type, value_sequence)
@@ -134,6 +402,8 @@ class Graph_MCMC:
         if name in self.G.vertex_properties:
             del self.G.vertex_properties[name]
             return True
+        if self.features is not None:
+            return self.features.remove_column(name)
         return False
 
     
@@ -142,32 +412,49 @@ class Graph_MCMC:
             self.G.vertex_properties[new_name] = self.G.vertex_properties[old_name]
             del self.G.vertex_properties[old_name]
             return True
+        if self.features is not None:
+            return self.features.rename_column(old_name, new_name)
         return False
 
 
+    def add_flags(self, names, flag_matrix):
+        """Adds (N x k) boolean flags to the packed feature store"""
+        if self.features is None:
+            N = self.G.num_vertices(ignore_filter=True)
+            self.features = FeatureStore(num_rows=N)
+        self.features.add_columns(names, flag_matrix)
+
+
+    def set_feature_store(self, store):
+        """Attaches packed feature store (rows aligned with vertex index), replacing any existing one"""
+        N = self.G.num_vertices(ignore_filter=True)
+        if store.num_rows != N:
+            raise ValueError("Expected {} rows, got {}".format(N, store.num_rows))
+        self.features = store
+
+
+    def build_feature_store(self):
+        """Moves all boolean vertex properties into the packed feature store"""
+        names = [name for name in self._get_property_feature_names() if self.get_property_map(name).value_type() == "bool"]
+        if len(names) > 0:
+            flag_matrix = np.column_stack([self.get_property_map(name).a for name in names])
+            self.add_flags(names, flag_matrix)
+            for name in names:
+                del self.G.vertex_properties[name]
+
+
     def convert_props_to_flags(self):
-        vertices = self.G.get_vertices()
-        property_names = self.get_feature_names()
+        property_names = self._get_property_feature_names()
 
         for name in property_names:
             value_map = self.get_property_map(name)
             value_type = value_map.value_type()
             if value_type == "string":
-                values = [value_map[vertex] for vertex in vertices]
-                distinct_features = set(values)
-
-                distinct_features.discard("") # remove empty string if it exists
-
-                for feature in sorted(distinct_features):
-                    bool_arr = []
-                    for value in values:
-                        if value == feature:
-                            bool_arr.append(True)
-                        else:
-                            bool_arr.append(False)
-                        
-                        self.add_property(feature, "bool", bool_arr)
-            
+                values = np.array(self._get_property_values(value_map))
+                distinct_features = np.unique(values)
+                distinct_features = distinct_features[distinct_features != ""] # remove empty string if it exists
+
+                self.add_flags(distinct_features, values[:, None] == distinct_features[None, :])
                 self.remove_property(name)
 
             elif value_type.startswith("int"):
@@ -183,29 +470,27 @@ class Graph_MCMC:
 
 
     def convert_to_flags(self, prop_name, new_prop_name=""):
-        vertices = self.G.get_vertices()
-
         if new_prop_name == "":
             new_prop_name = prop_name + "-"
 
-        if prop_name in self.get_feature_names():
+        if prop_name in self._get_property_feature_names():
             value_map = self.get_property_map(prop_name)
 
-            values = [value_map[vertex] for vertex in vertices]
-            distinct_values = set(values)
+            values = np.array(self._get_property_values(value_map))
+            distinct_values = np.unique(values)
 
-            for chosen_value in sorted(distinct_values):
-                bool_arr = []
-                for value in values:
-                    if value == chosen_value:
-                        bool_arr.append(True)
-                    else:
-                        bool_arr.append(False)
-                    
-                    self.add_property(new_prop_name + str(chosen_value), "bool", bool_arr)
-        
+            names = [new_prop_name + str(value) for value in distinct_values]
+            self.add_flags(names, values[:, None] == distinct_values[None, :])
             self.remove_property(prop_name)
 
+
+    def _get_property_values(self, value_map):
+        """Values of a scalar property for every vertex index (ignoring filters)"""
+        if value_map.value_type() != "string":
+            return value_map.a
+        N = self.G.num_vertices(ignore_filter=True)
+        return [value_map[vertex] for vertex in range(0, N)]
+
     
     def get_property_map(self, prop_name):
         property_map = self.G.vertex_properties[prop_name]
@@ -213,12 +498,18 @@ class Graph_MCMC:
 
     
     def get_feature_names(self):
-        """returns array of feature names"""
+        """returns array of feature names (vertex properties then packed flags)"""
+        feature_names = self._get_property_feature_names()
+        if self.features is not None:
+            feature_names.extend(self.features.names)
+        return feature_names
+
+
+    def _get_property_feature_names(self):
         properties = self.G.vertex_properties
         # return [key.replace("\x00", "-") for key in properties.keys()]
         names = list(properties.keys())
-        feature_names = [name for name in names if name.startswith("_") == False]
-        return feature_names
+        return [name for name in names if name.startswith("_") == False]
 
 
     # sampling methods
@@ -227,91 +518,511 @@ class Graph_MCMC:
         N = self.G.num_vertices()
         b = np.random.choice(np.arange(0,B,1), size=N)
         self.state = BlockState(self.G, b=b, B=B)
+        self.nested_state = None
 
 
-    def partition(self, B_min=None, B_max=None, degree_corrected=True):
+    def partition(self, B_min=None, B_max=None, degree_corrected=True, seed=None, refresh=False, nested=False,
+                  init=None, refine_sweeps=10, restarts=1, B_values=None, processes=None):
         """
         Performs MCMC algorithm to minimise description length (DL)
+        Seeded results are read from / written to the cache unless refresh is set
+        nested: fit hierarchical SBM (state is then its lowest level)
+        init: "spectral" (Bethe Hessian) or "abp" to warm start from a fast initial
+            partition refined by refine_sweeps greedy merge-split sweeps instead of
+            running minimize_blockmodel_dl from scratch (flat mode only); ABP gives 2 blocks
+            so cannot be used with B pinned to another value. B_min / B_max bound the
+            spectral seed and gate merges / splits, a single sweep may still overshoot them
+        restarts: independent fits per candidate B, run across a process pool
+        B_values: candidate numbers of blocks, each fitted with B_min = B_max = B
+            (instead of the single range B_min..B_max)
+        The minimum DL fit is kept and self.dl_table holds rows of (B, restart, DL)
         returns partition array
         """
-        print("Performing inference...")
-        self.state = minimize_blockmodel_dl(self.G, B_min=B_min, B_max=B_max, deg_corr=degree_corrected, mcmc_args=self.mcmc_args, verbose=True)
-        print("Done")
+        if init is not None and nested:
+            raise ValueError("Warm start is only supported in flat mode")
+
+        key = self.cache.key("partition", self.graph_hash(), B_min, B_max, degree_corrected, self.mcmc_args, seed, nested,
+                             init, refine_sweeps, restarts, B_values)
+        cached = None if refresh or seed is None else self.cache.load(key)
+        self.deg_corr = degree_corrected
+
+        if cached is not None:
+            print("Loaded partition from cache")
+            self._restore_state(cached)
+            self.dl_table = cached.get("dl_table")
+            return self.state.get_blocks()
+
+        if restarts > 1 or B_values is not None:
+            self._partition_pool(B_min, B_max, degree_corrected, seed, nested, init, refine_sweeps, restarts, B_values, processes)
+            self.print_dl_table()
+        else:
+            self._seed(seed)
+            print("Performing inference...")
+            if nested:
+                self.nested_state = minimize_nested_blockmodel_dl(self.G, B_min=B_min, B_max=B_max, deg_corr=degree_corrected, mcmc_args=self.mcmc_args, verbose=True)
+                self.state = self.nested_state.levels[0]
+            elif init is not None:
+                self.nested_state = None
+                self.state = self._warm_start_state(init, B_min, B_max, degree_corrected, refine_sweeps, seed)
+            else:
+                self.nested_state = None
+                self.state = minimize_blockmodel_dl(self.G, B_min=B_min, B_max=B_max, deg_corr=degree_corrected, mcmc_args=self.mcmc_args, verbose=True)
+            self.dl_table = np.array([[self.state.get_nonempty_B(), 0, self.description_length()]])
+            print("Done")
+
+        if seed is not None:
+            # unseeded fits stay random across calls
+            self.cache.save(key, dl_table=self.dl_table, **self._state_arrays())
         return self.state.get_blocks()
 
-    
-    def mcmc(self, num_iter=10000, burn_in=0.20, thinning=5, verbose=False):
+
+    def _partition_pool(self, B_min, B_max, degree_corrected, seed, nested, init, refine_sweeps, restarts, B_values, processes):
+        """Fans fits over (candidate B x restart) across a process pool, keeping the minimum DL state"""
+        ranges = [(B_min, B_max)] if B_values is None else [(B, B) for B in B_values]
+        if seed is None:
+            seed = np.random.randint(2**31 - restarts * len(ranges))
+
+        tasks = []
+        for B_lo, B_hi in ranges:
+            for restart in range(restarts):
+                tasks.append((B_lo, B_hi, seed + len(tasks), restart))
+
+        args = dict(deg_corr=degree_corrected, mcmc_args=self.mcmc_args, nested=nested, init=init, refine_sweeps=refine_sweeps)
+        initargs = (self.G.get_edges(), self.G.num_vertices(ignore_filter=True), self.G.is_directed(),
+                    self._vertex_mask(), args)
+
+        print("Performing inference over {} fits...".format(len(tasks)))
+        with Pool(processes, initializer=_init_partition_worker, initargs=initargs) as pool:
+            results = list(tqdm(pool.imap(_partition_worker, tasks), total=len(tasks)))
+        print("Done")
+
+        rows = [(B, restart, dl) for (_B_lo, _B_hi, _seed, restart), (B, dl, _arrays) in zip(tasks, results)]
+        self.dl_table = np.array(rows, dtype=float)
+
+        best = int(np.argmin(self.dl_table[:, 2]))
+        self._restore_state(results[best][2])
+
+
+    def _vertex_mask(self):
+        """Boolean vertex filter (None if graph is unfiltered)"""
+        if self.G.get_vertex_filter()[0] is None:
+            return None
+        mask = np.zeros(self.G.num_vertices(ignore_filter=True), dtype=bool)
+        mask[self.G.get_vertices()] = True
+        return mask
+
+
+    def description_length(self):
+        """DL of current (nested) state"""
+        if self.nested_state is not None:
+            return self.nested_state.entropy(**self.entropy_args)
+        return self.state.entropy(**self.entropy_args)
+
+
+    def print_dl_table(self):
+        """Prints minimum DL found for each number of blocks"""
+        print("{:>6} {:>8} {:>14}".format("B", "restarts", "min DL"))
+        for B in np.unique(self.dl_table[:, 0]):
+            rows = self.dl_table[self.dl_table[:, 0] == B]
+            print("{:>6} {:>8} {:>14.2f}".format(int(B), len(rows), rows[:, 2].min()))
+
+
+    def _warm_start_state(self, init, B_min, B_max, degree_corrected, refine_sweeps, seed):
+        """
+        BlockState seeded from a spectral / ABP partition, refined by greedy sweeps
+        With B pinned (B_min == B_max) refinement only moves single vertices between the seeded blocks,
+        otherwise merge-split moves are gated so merges stop at B_min and splits at B_max
+        """
+        fixed_B = B_min is not None and B_min == B_max
+        if init == "abp" and fixed_B and B_min != 2:
+            raise ValueError("ABP finds 2 blocks, cannot warm start with B pinned to {}".format(B_min))
+
+        vertices = self.G.get_vertices()
+        b = np.zeros(self.G.num_vertices(ignore_filter=True), dtype=np.int64)
+        b[vertices] = self.initial_partition(init, B_min, B_max, seed)
+        B = int(b[vertices].max()) + 1
+
+        state = BlockState(self.G, b=self._to_vertex_property(b), B=B, deg_corr=degree_corrected)
+        print("Initial {} partition: B={}, DL={}".format(init, B, state.entropy(**self.entropy_args)))
+
+        for _ in range(refine_sweeps):
+            if fixed_B:
+                # single-vertex moves that can neither create nor vacate blocks
+                state.mcmc_sweep(beta=np.inf, d=0, niter=10, allow_vacate=False, entropy_args=self.entropy_args)
+                continue
+
+            for _ in range(10):
+                B = state.get_nonempty_B()
+                psplit = 0 if B_max is not None and B >= B_max else 1
+                pmerge = 0 if B_min is not None and B <= B_min else 1
+                state.multiflip_mcmc_sweep(beta=np.inf, niter=1, psplit=psplit, pmerge=pmerge, entropy_args=self.entropy_args)
+
+        B = state.get_nonempty_B()
+        if (B_min is not None and B < B_min) or (B_max is not None and B > B_max):
+            print("Warning: warm start ended with B={} outside [{}, {}]".format(B, B_min, B_max))
+        return state
+
+
+    def initial_partition(self, method, B_min=None, B_max=None, seed=None):
+        """
+        Fast initial partition of the vertices in get_vertices() order
+        method: "spectral" (Bethe Hessian, number of blocks estimated within [B_min, B_max])
+            or "abp" (two communities)
+        """
+        vertices = self.G.get_vertices()
+        if method == "spectral":
+            adjacency = spectral_adjacency(self.G).tocsr()[vertices][:, vertices]
+            adjacency = adjacency + adjacency.T if self.G.is_directed() else adjacency
+            labels, _vectors = spectral_partition(adjacency, k_min=B_min or 1, k_max=B_max, seed=seed)
+        elif method == "abp":
+            abp_graph = Graph(self.G.get_edges()[:, :2])
+            abp_graph.abp(seed=seed)
+            labels = np.zeros(len(vertices), dtype=np.int64)
+            position = {vertex: i for i, vertex in enumerate(vertices)}
+            for vertex, index in abp_graph.vertex_to_index.items():
+                labels[position[vertex]] = abp_graph.assignments[index]
+        else:
+            raise ValueError("Unknown initial partition: " + str(method))
+
+        # relabel to contiguous 0..B-1
+        return np.unique(labels, return_inverse=True)[1]
+
+
+    def mcmc(self, num_iter=10000, burn_in=0.20, thinning=5, verbose=False, seed=None, refresh=False,
+             checkpoint=None, checkpoint_interval=1000, resume=None, vertices=None,
+             auto_stop=False, check_interval=100, tol=0.02,
+             adaptive=False, revisit_interval=10, entropy_threshold=0.01, adapt_after=10):
         """
         Performs mcmc sampling of posterior on blocks
+        Seeded results are read from / written to the cache unless refresh is set
+        In nested mode whole hierarchy is swept and marginals are kept for every level
+
+            Parameters:
+                checkpoint (str): .npz path written every checkpoint_interval sweeps
+                resume (str): checkpoint to continue from (also used as checkpoint if none given),
+                    restores the fitted state so no prior partition is needed; num_iter and
+                    checkpoint_interval must match the interrupted run
+                vertices (int[]): only sweep these vertices (others keep their blocks, flat mode only)
+                auto_stop (bool): ignore burn_in, detect it from the entropy trace (Geweke) and
+                    stop before num_iter once marginals of successive check_interval windows
+                    differ by less than tol (mean total variation)
+                adaptive (bool): once adapt_after samples are collected, only sweep vertices whose running
+                    block-marginal entropy exceeds entropy_threshold (nats), with a full sweep every
+                    revisit_interval sweeps, at which the set of targeted vertices is refreshed (flat mode only)
+
+        With a seed the graph-tool RNG is reseeded every checkpoint_interval sweeps,
+        so a resumed run reproduces the uninterrupted one
         returns: av_entropy_per_node - average netropy per node
         """
-        bs = [] # collect some partitions
-        sum_entropy = 0
+        resumed = None
+        if resume is not None:
+            resumed = load_npz(resume)
+            if resumed is None:
+                print("No checkpoint at {} >> starting afresh".format(resume))
+            if checkpoint is None:
+                checkpoint = resume
+
+        if resumed is None:
+            initial_state = self._state_arrays()
+        else:
+            for name, value in [("num_iter", num_iter), ("checkpoint_interval", checkpoint_interval)]:
+                if int(resumed[name]) != value:
+                    raise ValueError("Checkpoint {} was written with {}={}, cannot resume with {}={}".format(
+                        resume, name, int(resumed[name]), name, value))
+
+            # fitted state comes from the checkpoint, so a fresh Graph_MCMC can resume
+            self.deg_corr = bool(resumed["deg_corr"])
+            initial_state = {key[len("initial_"):]: value for key, value in resumed.items() if key.startswith("initial_")}
+            self._restore_state(resumed)
+            seed = None if int(resumed["seed"]) < 0 else int(resumed["seed"])
+
+        mcmc_kwargs = {"num_iter": num_iter, "burn_in": burn_in, "thinning": thinning, "entropy_args": self.entropy_args, "checkpoint_interval": checkpoint_interval}
+        if auto_stop:
+            mcmc_kwargs.update({"auto_stop": True, "check_interval": check_interval, "tol": tol})
+        if adaptive:
+            if self.nested_state is not None:
+                raise ValueError("Adaptive vertex scheduling is only supported in flat mode")
+            mcmc_kwargs.update({"adaptive": True, "revisit_interval": revisit_interval, "entropy_threshold": entropy_threshold, "adapt_after": adapt_after})
+        if vertices is not None:
+            if self.nested_state is not None:
+                raise ValueError("Restricting sweeps to vertices is only supported in flat mode")
+            vertices = np.asarray(vertices, dtype=np.int64)
+            mcmc_kwargs["vertices"] = vertices.tolist()
+        key = self.cache.key("mcmc", self.graph_hash(), *[initial_state[name] for name in sorted(initial_state)], self.deg_corr, mcmc_kwargs, seed)
+        cached = None if refresh or seed is None else self.cache.load(key)
+
+        if cached is not None:
+            print("Loaded mcmc samples from cache")
+            self._restore_state(cached)
+            self.entropy_arr = cached["entropy_arr"]
+            self.burn_in_sweep, self.stop_sweep = int(cached["burn_in_sweep"]), int(cached["stop_sweep"])
+            self._set_marginal_counts([cached["marginals_" + str(l)] for l in range(0, int(cached["num_marginal_levels"]))])
+            return float(cached["av_entropy"])
+
+        self._seed(seed)
+        bs = [] # collect some partitions (num_levels x N per sample)
+        sample_sweeps = [] # sweep at which each partition was collected
+        sample_entropies = []
         num_entities = self.G.num_vertices() + self.G.num_edges()
+        sampling_state = self.state if self.nested_state is None else self.nested_state
+
 
+        # running block counts used by the adaptive scheduler
+        running_counts = np.zeros((self.G.num_vertices(ignore_filter=True), self.state.get_B()), dtype=np.int64) if adaptive else None
+        candidates = self.G.get_vertices() if vertices is None else vertices
+        active = None # vertices targeted between full sweeps (None: sweep all)
+        self.num_vertex_moves = 0
 
-        def collect_partitions(s):
-            bs.append(s.b.a.copy())
+        def collect_partitions(s, i):
+            bs.append(self._project_levels())
+            sample_sweeps.append(i)
+            sample_entropies.append(current_entropy)
+            if adaptive:
+                running_counts[np.arange(running_counts.shape[0]), bs[-1][0]] += 1
 
-        current_entropy = self.state.entropy(partition_dl=False) # must specify manually
+        current_entropy = sampling_state.entropy(**self.entropy_args) # must specify manually
         self.entropy_arr = np.zeros(num_iter)
+        start_iter = 0
+
+        if resumed is not None:
+            bs.extend(resumed["bs"])
+            sample_sweeps.extend(resumed["sample_sweeps"].tolist())
+            sample_entropies.extend(resumed["sample_entropies"].tolist())
+            self.entropy_arr[:] = resumed["entropy_arr"]
+            current_entropy = float(resumed["current_entropy"])
+            start_iter = int(resumed["i"])
+            restore_rng_state(resumed)
+            if adaptive:
+                running_counts[:] = label_counts(np.array(resumed["bs"])[:, 0, :], running_counts.shape[1]) if len(bs) > 0 else 0
+                active = None if int(resumed["num_active"]) < 0 else resumed["active"].tolist()
+            print("Resuming from sweep {}".format(start_iter))
+
+        def save_checkpoint(i):
+            arrays = {"initial_" + name: value for name, value in initial_state.items()}
+            arrays.update(self._state_arrays())
+            atomic_savez(
+                checkpoint, i=i, num_iter=num_iter, checkpoint_interval=checkpoint_interval, deg_corr=self.deg_corr,
+                bs=np.array(bs).reshape((len(bs), -1, self.G.num_vertices(ignore_filter=True))),
+                sample_sweeps=np.array(sample_sweeps, dtype=np.int64), sample_entropies=np.array(sample_entropies),
+                entropy_arr=self.entropy_arr, current_entropy=current_entropy,
+                seed=-1 if seed is None else seed, active=np.array(active if active is not None else [], dtype=np.int64),
+                num_active=-1 if active is None else len(active), **arrays, **rng_state_arrays()
+            )
 
         interval = num_iter // 10
-        start = int(burn_in*num_iter)
+        start = 0 if auto_stop else int(burn_in*num_iter)
+        self.burn_in_sweep, self.stop_sweep = start, num_iter
+
+        for i in tqdm(range(start_iter, num_iter)):
+                if seed is not None and i % checkpoint_interval == 0:
+                    seed_rng(seed + i)
+
+                sweep_vertices = vertices
+                if adaptive and i >= start:
+                    if (i - start) % revisit_interval == 0:
+                        # full sweep, then refresh targets from running marginals
+                        active = None
+                        if len(bs) >= adapt_after:
+                            entropy = marginal_entropy(running_counts[candidates])
+                            active = np.asarray(candidates)[entropy > entropy_threshold].tolist()
+                    else:
+                        sweep_vertices = active if active is not None else vertices
 
-        for i in tqdm(range(0, num_iter)):
-                dS, nattempts, nmoves = self.state.mcmc_sweep(niter=1, d=0.00, entropy_args=self.entropy_args)
+                if sweep_vertices is not None and len(sweep_vertices) == 0:
+                    dS, nattempts, nmoves = 0, 0, 0
+                elif self.nested_state is None:
+                    dS, nattempts, nmoves = self.state.mcmc_sweep(niter=1, d=0.00, entropy_args=self.entropy_args, vertices=sweep_vertices)
+                else:
+                    dS, nattempts, nmoves = self.nested_state.mcmc_sweep(niter=1, d=0.00, entropy_args=self.entropy_args)
                 current_entropy += dS
+                self.num_vertex_moves += nattempts
                 offset = i - start
                 self.entropy_arr[i] = current_entropy / num_entities
 
                 if offset >= 0 and offset % thinning == 0:
-                    sum_entropy += current_entropy
-                    collect_partitions(self.state)
+                    collect_partitions(sampling_state, i)
                     if verbose and i % interval == 0:
                         print("i: {}, dS: {}, nattempts: {}, nmoves: {}".format(i, dS, nattempts, nmoves))
 
+                if checkpoint is not None and (i + 1) % checkpoint_interval == 0:
+                    save_checkpoint(i + 1)
 
-        # Disambiguate partitions and obtain marginals
-        num_iter_kept = len(bs)
-        pmode = PartitionModeState(bs, converge=True, relabel=True)
-        pv = pmode.get_marginal(self.G)
+                if auto_stop and (i + 1) % check_interval == 0 and self._has_converged(bs, sample_sweeps, i + 1, check_interval, tol):
+                    break
 
-        # Now the node marginals are stored in property map pv. We can
-        # visualize them as pie charts on the nodes:
-        self.vertex_block_counts = pv
-        self.B_max = pmode.get_B()
-        self.pmode = pmode
+        if auto_stop:
+            if self.stop_sweep == num_iter:
+                detected = detect_burn_in(self.entropy_arr)
+                self.burn_in_sweep = detected if detected is not None else int(burn_in*num_iter)
+                print("Marginals did not stabilise within {} sweeps".format(num_iter))
+            self.entropy_arr = self.entropy_arr[:self.stop_sweep]
+            kept = np.array(sample_sweeps) >= self.burn_in_sweep
+            bs = [sample for sample, keep in zip(bs, kept) if keep]
+            sample_entropies = np.array(sample_entropies)[kept]
+            print("Burn-in detected at sweep {}, stopped at sweep {}".format(self.burn_in_sweep, self.stop_sweep))
+
+
+        # Disambiguate partitions and obtain marginals (separately at each level)
+        num_iter_kept = len(bs)
+        level_counts = []
+        for level in range(0, len(bs[0])):
+            pmode = PartitionModeState([sample[level] for sample in bs], converge=True, relabel=True)
+            pv = pmode.get_marginal(self.G)
+            level_counts.append(self._marginals_to_array(pv, pmode.get_B()))
+            if level == 0:
+                level_zero_pmode = pmode
+
+        self._set_marginal_counts(level_counts)
+        self.pmode = level_zero_pmode
         
         #calc av entropy
-        av_entropy_per_entity = sum_entropy / (num_iter_kept * num_entities)
+        av_entropy_per_entity = np.sum(sample_entropies) / (num_iter_kept * num_entities)
         if verbose:
             print("Average per node entropy: " + str(av_entropy_per_entity))
+            print("Attempted vertex moves: " + str(self.num_vertex_moves))
+
+        if seed is not None:
+            marginal_arrays = {"marginals_" + str(l): counts for l, counts in enumerate(level_counts)}
+            self.cache.save(
+                key, entropy_arr=self.entropy_arr, av_entropy=av_entropy_per_entity, burn_in_sweep=self.burn_in_sweep, stop_sweep=self.stop_sweep,
+                num_marginal_levels=len(level_counts), **marginal_arrays, **self._state_arrays()
+            )
             
         return av_entropy_per_entity
 
 
+    def vertex_marginal_entropy(self, level=0):
+        """
+        Entropy (nats) of each vertex's block marginal from the last mcmc run
+        Rows aligned with vertex index, gather with G.get_vertices()
+        """
+        if self.level_marginal_counts is None:
+            raise ValueError("No marginals, run mcmc first")
+        return marginal_entropy(self.level_marginal_counts[level])
+
+
+    def _has_converged(self, bs, sample_sweeps, num_sweeps, window, tol):
+        """
+        Checks for burn-in in entropy trace so far, then compares level-0 marginals
+        of the last two windows of sweeps after it (sets burn_in_sweep / stop_sweep)
+        """
+        burn_in = detect_burn_in(self.entropy_arr[:num_sweeps])
+        if burn_in is None:
+            return False
+
+        sample_sweeps = np.array(sample_sweeps)
+        previous = (sample_sweeps >= max(burn_in, num_sweeps - 2 * window)) & (sample_sweeps < num_sweeps - window)
+        latest = sample_sweeps >= num_sweeps - window
+        if num_sweeps - 2 * window < burn_in or not previous.any() or not latest.any():
+            return False
+
+        level_zero = np.array([sample[0] for sample in bs])
+        B = int(level_zero.max()) + 1
+        change = total_variation(label_counts(level_zero[previous], B), label_counts(level_zero[latest], B))
+        if change >= tol:
+            return False
+
+        self.burn_in_sweep, self.stop_sweep = burn_in, num_sweeps
+        return True
+
+
+    # cache helpers
+    def graph_hash(self):
+        """Content hash of the (filtered) edge list and training features"""
+        parts = [self.G.get_edges()]
+        for name in self._get_property_feature_names():
+            value_map = self.get_property_map(name)
+            if value_map.value_type() == "string":
+                parts.append([name, self._get_property_values(value_map)])
+            else:
+                parts.extend([name, np.asarray(value_map.a)])
+        if self.features is not None:
+            parts.extend([self.features.names, np.asarray(self.features.packed)])
+        return self.cache.key("graph", *parts)
+
+
+    def _state_arrays(self):
+        """Block state (and hierarchy in nested mode) as a dict of arrays"""
+        arrays = {"b": self.state.b.a.copy(), "B": self.state.get_B()}
+        if self.nested_state is not None:
+            levels = self.nested_state.get_bs()
+            arrays["num_levels"] = len(levels)
+            for level in range(1, len(levels)):
+                arrays["level_b_" + str(level)] = np.array(levels[level])
+        return arrays
+
+
+    def _restore_state(self, arrays):
+        """Inverse of _state_arrays"""
+        if "num_levels" in arrays:
+            bs = [arrays["b"]] + [arrays["level_b_" + str(level)] for level in range(1, int(arrays["num_levels"]))]
+            self.nested_state = NestedBlockState(self.G, bs=bs, state_args=dict(deg_corr=self.deg_corr))
+            self.state = self.nested_state.levels[0]
+        else:
+            self.nested_state = None
+            self.state = BlockState(self.G, b=self._to_vertex_property(arrays["b"]), B=int(arrays["B"]), deg_corr=self.deg_corr)
+
+
+    def _project_levels(self):
+        """(num_levels x N) block of each vertex at every level of the hierarchy"""
+        labels = self.state.b.a.copy()
+        if self.nested_state is None:
+            return labels.reshape(1, -1)
+
+        projected = [labels]
+        for level_b in self.nested_state.get_bs()[1:]:
+            labels = np.asarray(level_b)[labels]
+            projected.append(labels)
+        return np.array(projected)
+
+
+    def _seed(self, seed):
+        if seed is not None:
+            np.random.seed(seed)
+            seed_rng(seed)
+
+
+    def _to_vertex_property(self, values):
+        return self.G.new_vertex_property("int", values)
+
+
+    def _marginals_to_array(self, pv, B):
+        """(N x B) array of marginal counts, rows aligned with vertex index"""
+        counts = np.zeros((self.G.num_vertices(ignore_filter=True), B), dtype=np.int64)
+        for vertex_id in self.G.get_vertices():
+            vertex_counts = pv[vertex_id]
+            counts[vertex_id, 0:len(vertex_counts)] = vertex_counts
+        return counts
+
+
+    def _set_marginal_counts(self, level_counts):
+        """Restores marginals from list of (N x B_l) arrays of counts (one per level)"""
+        counts = level_counts[0]
+        pv = self.G.new_vertex_property("vector<int>")
+        pv.set_2d_array(counts.T.copy())
+        self.vertex_block_counts = pv
+        self.B_max = counts.shape[1]
+        self.marginal_counts = counts
+        self.level_marginal_counts = level_counts
+        self.pmode = None
+        self.draw_state = None
+
+
     # training methods
-    def generate_posterior(self):
+    def generate_posterior(self, level=0):
         """
         return Y: (N x B) matrix of posterior probabilities
-        Y[n, b] = Prob vertex n belongs to block b
+        Y[n, b] = Prob vertex n belongs to block b (at given level in nested mode)
         """
         vertices = self.G.get_vertices()
-        N = len(vertices)
-        B = self.B_max
+        counts = self.level_marginal_counts[level][vertices, :]
+        totals = np.sum(counts, axis=1, keepdims=True)
+        return counts / totals
 
-        posterior_probs = np.zeros((N, B))
 
-        for idx, vertex_id in enumerate(vertices):
-            counts = self.vertex_block_counts[vertex_id]
-            total = np.sum(counts)
-            probs = counts / total
-            b = len(probs)
-
-            posterior_probs[idx, 0:b] = probs[:]
-
-        return posterior_probs
+    def get_max_blocks(self):
+        """Maximum marginal block of each vertex (indexed by vertex index)"""
+        return np.argmax(self.marginal_counts, axis=1)
 
     
     def generate_feature_matrix(self):
@@ -319,28 +1030,25 @@ class Graph_MCMC:
         return X: (N x D) matrix of node features
         X[n, d] = feature d of vertex n
         """
-        properties = self.get_feature_names()
-        D = len(properties)
-
+        properties = self._get_property_feature_names()
         vertices = self.G.get_vertices()
-        
         N = len(vertices)
-        X = np.empty((N, D))
 
-        for prop_index, prop_name in enumerate(properties):
-            value_map = self.get_property_map(prop_name)
-            for vertex_index, vertex_id in enumerate(vertices):
-                X[vertex_index, prop_index] = value_map[vertex_id]
+        columns = [np.asarray(self.get_property_map(prop_name).a)[vertices] for prop_name in properties]
+        X = np.column_stack(columns).astype(float) if len(columns) > 0 else np.empty((N, 0))
+
+        if self.features is not None:
+            X = np.hstack((X, self.features.to_dense(rows=vertices)))
         
         return X
 
     
-    def sample_classifier_sgld(self, num_iter, step_scaling=1, sigma=1, verbose=False):
+    def sample_classifier_sgld(self, num_iter, step_scaling=1, sigma=1, verbose=False, level=0):
         if self.vertex_block_counts is None:
             print("Cannot sample without marginals")
         else:
             X = self.generate_feature_matrix()
-            Y = self.generate_posterior()
+            Y = self.generate_posterior(level=level)
 
             D = X.shape[1]
             B = Y.shape[1]
@@ -354,12 +1062,12 @@ class Graph_MCMC:
             return classifier
 
 
-    def sample_classifier_mala(self, num_iter, step_scaling=1, sigma=1, verbose=False):
+    def sample_classifier_mala(self, num_iter, step_scaling=1, sigma=1, verbose=False, level=0):
         if self.state is None:
             print("No state partition detected >> ABORT")
         else:
             X = self.generate_feature_matrix()
-            Y = self.generate_posterior()
+            Y = self.generate_posterior(level=level)
 
             D = X.shape[1]
             B = Y.shape[1]
@@ -370,77 +1078,118 @@ class Graph_MCMC:
             return classifier
     
 
-    def sample_classifier_mcmc(self, num_iter, verbose=False):
+    def sample_classifier_mcmc(self, num_iter, classifier_steps=1, step_scaling=1, sigma=1, verbose=False):
+        """
+        Jointly samples partition and classifier, alternating one block sweep
+        with classifier_steps SGLD steps on the current hard partition
+
+        Sweeps never open new blocks (no splits, d=0) so the one-hot targets
+        keep a fixed width of state.get_B() and only rows of moved vertices change
+        """
         if self.state is None:
             print("No state partition detected >> ABORT")
         else:
-            properties = self.get_feature_names()
-            D = len(properties)
-
-            B = self.state.get_nonempty_B()
             vertices = self.G.get_vertices()
-            N = len(vertices)
-
             X = self.generate_feature_matrix()
 
-            classifier = SoftmaxNeuralNet(layers_size=[D, B])
-
-            def sgld_iterate(state):
-                blocks = state.get_blocks()
-                Y = np.empty(N)
-
-                for vertex_index, vertex_id in enumerate(vertices):
-                    Y[vertex_index] = blocks[vertex_id]
+            D = X.shape[1]
+            B = self.state.get_B()
 
-                Y = from_values_to_one_hot(Y)
-                cost = classifier.sgld_iterate(X=X, Y=Y)
-                return cost
+            labels = self.state.b.a[vertices].copy()
+            Y = labels_to_one_hot(labels, B)
 
+            classifier = SoftmaxNeuralNet(layers_size=[D, B], sigma=sigma)
             classifier.sgld_initialise()
 
-            # mcmc_equilibrate(self.state, force_niter=num_iter, callback=sgld_iterate, verbose=verbose)
             for i in tqdm(range(0, num_iter)):
-                dS, nattempts, nmoves = self.state.multiflip_mcmc_sweep(niter=1, psplit=0)
-                cost = sgld_iterate(self.state)
+                dS, nattempts, nmoves = self.state.multiflip_mcmc_sweep(niter=1, psplit=0, d=0)
+
+                new_labels = self.state.b.a[vertices]
+                moved = np.flatnonzero(new_labels != labels)
+                Y[moved, labels[moved]] = 0
+                Y[moved, new_labels[moved]] = 1
+                labels[moved] = new_labels[moved]
+
+                for _step in range(0, classifier_steps):
+                    cost = classifier.sgld_iterate(X=X, Y=Y, step_scaling=step_scaling)
+
                 if verbose and i % 10 == 0:
                     print("i: {}, dS: {}, nattempts: {}, nmoves: {}, cost: {}".format(i, dS, nattempts, nmoves, cost))
 
             return classifier
 
 
-    def gen_training_set(self, fraction):
-        all_vertices = self.G.get_vertices()
-        vertex_list = [vertex for vertex in all_vertices]
+    def gen_training_set(self, fraction, stratify=False, seed=None):
+        """
+        Splits vertices into training and test sets
 
-        training_set_size = int(len(vertex_list) * fraction)
-        training_vertices = np.random.choice(vertex_list, size=training_set_size, replace=False)
+            Parameters:
+                fraction (float): fraction of vertices used for training
+                stratify (bool): split each MAP block separately so all appear in both sets
+                seed (int): optional seed for reproducible splits
 
-        self.training_vertices = training_vertices
-        
-        test_vertices = vertex_list.copy()
-        for vertex in self.training_vertices:
-            test_vertices.remove(vertex)
+            Returns:
+                train_indices (int[]): rows of X / Y in training set
+                test_indices (int[]): rows of X / Y in test set
+        """
+        vertices = self.G.get_vertices()
+
+        if stratify:
+            train_indices, test_indices = stratified_index_arr(self.get_map_blocks(), fraction, seed=seed)
+        else:
+            train_indices, test_indices = random_index_arr(len(vertices), fraction, seed=seed)
+
+        self.training_vertices = vertices[train_indices]
+        self.test_vertices = vertices[test_indices]
+        return train_indices, test_indices
 
-        self.test_vertices = test_vertices
+
+    def gen_k_folds(self, k, stratify=False, seed=None):
+        """Returns k (train_indices, test_indices) pairs indexing rows of X / Y"""
+        labels = self.get_map_blocks() if stratify else None
+        return k_fold_index_arrs(self.G.num_vertices(), k, labels=labels, seed=seed)
+
+
+    def get_map_blocks(self):
+        """MAP block of each vertex in get_vertices() order"""
+        vertices = self.G.get_vertices()
+        if self.marginal_counts is not None:
+            return self.get_max_blocks()[vertices]
+        return self.state.b.a[vertices]
 
     
     # visualisation
-    def draw(self, output=None, gen_layout=True, size=5, circular=True):
+    def draw(self, output=None, gen_layout=True, size=5, circular=True, aggregate=False, max_vertices=10000, seed=None):
+        """
+        Draws graph coloured by (soft) partition
+        gen_layout: use sfdp layout (computed once, cached on disk by graph hash) rather than "_pos"
+        aggregate: draw one node per block instead (see draw_blocks)
+        Graphs with more than max_vertices vertices are drawn from a block-stratified
+        sample of max_vertices vertices, coloured by block without pie charts
+        """
+        if aggregate:
+            return self.draw_blocks(output)
+
         output = gen_output_path(output)
         vprops = {"size": size}
         
+        large = self.G.num_vertices() > max_vertices
+        radial = circular and self.state is not None and self.vertex_block_counts is not None and not large
+
         pos = None
         if gen_layout == False and "_pos" in self.G.vertex_properties:
             pos = self.G.vertex_properties["_pos"]
+        elif gen_layout and not radial:
+            pos = self.get_layout()
+
+        if large:
+            return self._draw_sample(output, pos, size, max_vertices, seed)
 
         if self.state is not None:
             if self.vertex_block_counts is not None:
                 print("Drawing soft partition")
                 if circular:
-                    b = self.pmode.get_max(self.G)
-                    bs = [b, np.zeros(self.B_max)]
-                    nestedState = NestedBlockState(self.G, bs=bs)
-                    nestedState.draw(vertex_shape="pie", vertex_pie_fractions=self.vertex_block_counts, output=output)   
+                    self._get_draw_state().draw(vertex_shape="pie", vertex_pie_fractions=self.vertex_block_counts, output=output)
                 else:
                     self.state.draw(pos=pos, vertex_shape="pie", vprops=vprops, vertex_pie_fractions=self.vertex_block_counts, output=output)
             else:
@@ -450,6 +1199,92 @@ class Graph_MCMC:
             print("No state partition detected >> draw default graph")
             graph_draw(self.G, pos=pos, vprops=vprops, output=output)
 
+
+    def draw_blocks(self, output=None, size_scale=5, width_scale=1):
+        """Draws one node per non-empty block (area ~ block size) with edges weighted by e_rs"""
+        if self.state is None:
+            print("No state partition detected >> cannot draw blocks")
+            return
+
+        output = gen_output_path(output)
+        matrix = self.state.get_matrix().tocoo()
+        block_sizes = np.asarray(self.state.get_nr().a)
+        blocks = np.flatnonzero(block_sizes)
+        block_index = np.full(len(block_sizes), -1)
+        block_index[blocks] = np.arange(len(blocks))
+
+        between = matrix.row < matrix.col
+        edges = np.column_stack((block_index[matrix.row[between]], block_index[matrix.col[between]]))
+        weights = matrix.data[between]
+
+        block_graph = GT_Graph(directed=False)
+        block_graph.add_vertex(len(blocks))
+        block_graph.add_edge_list(edges)
+
+        vertex_size = block_graph.new_vertex_property("double", size_scale * np.sqrt(block_sizes[blocks]))
+        vertex_text = block_graph.new_vertex_property("int", blocks)
+        edge_weight = block_graph.new_edge_property("double", weights)
+        pen_width = block_graph.new_edge_property("double", width_scale * np.log1p(weights))
+
+        print("Drawing {} blocks".format(len(blocks)))
+        graph_draw(block_graph, pos=sfdp_layout(block_graph, eweight=edge_weight), vertex_size=vertex_size,
+                   vertex_text=vertex_text, vertex_fill_color=self._block_colours(block_graph, np.arange(len(blocks))),
+                   edge_pen_width=pen_width, output=output)
+
+
+    def get_layout(self, refresh=False):
+        """sfdp layout as vertex property, cached on disk by graph hash"""
+        key = self.cache.key("layout", self.graph_hash())
+        cached = None if refresh else self.cache.load(key)
+
+        pos = self.G.new_vertex_property("vector<double>")
+        if cached is not None:
+            pos.set_2d_array(cached["pos"].T.copy())
+            return pos
+
+        print("Generating layout...")
+        pos = sfdp_layout(self.G)
+        self.cache.save(key, pos=pos.get_2d_array([0, 1]).T)
+        return pos
+
+
+    def _get_draw_state(self):
+        """Nested state (max marginal blocks under single root) for circular drawing, built once per marginals"""
+        if self.draw_state is None:
+            b = self._to_vertex_property(self.get_max_blocks())
+            bs = [b, np.zeros(self.B_max)]
+            self.draw_state = NestedBlockState(self.G, bs=bs)
+        return self.draw_state
+
+
+    def _draw_sample(self, output, pos, size, max_vertices, seed):
+        """Draws block-stratified sample of vertices, coloured by (max marginal) block"""
+        vertices = self.G.get_vertices()
+        if self.state is None:
+            labels = np.zeros(len(vertices), dtype=np.int64)
+        elif self.vertex_block_counts is not None:
+            labels = self.get_max_blocks()[vertices]
+        else:
+            labels = self.state.b.a[vertices]
+
+        kept, _rest = stratified_index_arr(labels, max_vertices / len(vertices), seed=seed)
+        mask = np.zeros(self.G.num_vertices(ignore_filter=True), dtype=bool)
+        mask[vertices[kept]] = True
+        sample = GraphView(self.G, vfilt=mask)
+
+        block = np.zeros(len(mask), dtype=np.int64)
+        block[vertices] = labels
+        print("Drawing sample of {} / {} vertices".format(len(kept), len(vertices)))
+        graph_draw(sample, pos=pos, vertex_size=size, vertex_fill_color=self._block_colours(sample, block),
+                   edge_pen_width=0.1, output=output)
+
+
+    def _block_colours(self, G, blocks):
+        """RGBA vertex property colouring vertex index i by blocks[i]"""
+        colours = G.new_vertex_property("vector<double>")
+        colours.set_2d_array(plt.get_cmap("tab20")(np.asarray(blocks) % 20).T.copy())
+        return colours
+
     
     def plot_matrix(self):
         if self.state is not None:
@@ -477,16 +1312,11 @@ class Graph_MCMC:
         else:
             B = self.state.get_nonempty_B()
             vertices = self.G.get_vertices()
-            N = len(vertices)
 
             X = self.generate_feature_matrix()
             D = X.shape[1]
 
-            blocks = self.state.get_blocks() # dictionary: vertex -> block_index
-            Y = np.empty(N)
-
-            for vertex_index, vertex_id in enumerate(vertices):
-                Y[vertex_index] = blocks[vertex_id]
+            Y = self.state.b.a[vertices]
 
             classifier = SoftmaxNeuralNet(layers_size=[D, B])
             classifier.fit(X, Y)
@@ -499,27 +1329,21 @@ class Graph_MCMC:
             properties = self.get_feature_names()
             num_properties = len(properties)
 
-            blocks = self.state.get_blocks()
             B = self.state.get_B()
             vertices = self.G.get_vertices()
-            block_counts = np.zeros(B)
-
-            for v in vertices:
-                block_index = blocks[v]
-                block_counts[block_index] += 1
+            blocks = self.state.b.a[vertices]
+            block_counts = np.bincount(blocks, minlength=B)
 
             width = 0.8 / num_properties
             idx = 0
 
             for prop_name in properties:
-                value_map = self.get_property_map(prop_name)
-                prop_counts = np.zeros(B)
-
-                for v in vertices:
-                    block_index = blocks[v]
+                if self.features is not None and prop_name in self.features.index:
+                    flags = self.features.column(prop_name, rows=vertices)
+                else:
+                    flags = np.asarray(self.get_property_map(prop_name).a)[vertices] != 0
 
-                    if value_map[v]:
-                        prop_counts[block_index] += 1
+                prop_counts = np.bincount(blocks, weights=flags, minlength=B)
 
                 prop_fractions = np.divide(prop_counts, block_counts)
                 x = np.array(range(0, B)) + (width * idx)
@@ -552,3 +1376,33 @@ class Graph_MCMC:
             plt.show()
         else:
             raise Exception("Vertex block counts not initialised")
+
+
+# partition pool workers (module level so they can be pickled)
+_worker_graph = None
+_worker_args = None
+
+
+def _init_partition_worker(edges, num_vertices, directed, vertex_mask, args):
+    """Rebuilds the graph once per worker process"""
+    global _worker_graph, _worker_args
+    G = GT_Graph(directed=directed)
+    G.add_vertex(num_vertices)
+    G.add_edge_list(edges)
+    if vertex_mask is not None:
+        G = GraphView(G, vfilt=vertex_mask)
+
+    _worker_graph = Graph_MCMC(use_cache=False)
+    _worker_graph.G = G
+    _worker_graph.mcmc_args = args["mcmc_args"]
+    _worker_graph.entropy_args = args["mcmc_args"]["entropy_args"]
+    _worker_args = args
+
+
+def _partition_worker(task):
+    """Single fit, returns (number of non-empty blocks, DL, state arrays)"""
+    B_min, B_max, seed, _restart = task
+    graph = _worker_graph
+    graph.partition(B_min=B_min, B_max=B_max, degree_corrected=_worker_args["deg_corr"], seed=seed, refresh=True,
+                    nested=_worker_args["nested"], init=_worker_args["init"], refine_sweeps=_worker_args["refine_sweeps"])
+    return graph.state.get_nonempty_B(), graph.description_length(), graph._state_arrays()
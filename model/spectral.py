@@ -0,0 +1,82 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import eigsh
+from sklearn.cluster import KMeans
+
+
+def bethe_hessian(adjacency, r=None):
+    """
+    Bethe Hessian H(r) = (r^2 - 1) I - r A + D of a sparse symmetric adjacency matrix
+
+        Parameters:
+            adjacency (scipy.sparse matrix): (N x N) symmetric adjacency
+            r (float): regulariser, defaults to sqrt of mean excess degree
+
+        Returns:
+            H (scipy.sparse.csr_matrix): Bethe Hessian
+            r (float): regulariser used
+    """
+    adjacency = sp.csr_matrix(adjacency, dtype=float)
+    degrees = np.asarray(adjacency.sum(axis=1)).ravel()
+
+    if r is None:
+        r = np.sqrt(max(np.sum(degrees ** 2) / np.sum(degrees) - 1, 1 + 1e-6))
+
+    N = adjacency.shape[0]
+    H = (r ** 2 - 1) * sp.identity(N) - r * adjacency + sp.diags(degrees)
+    return H.tocsr(), r
+
+
+def spectral_embedding(adjacency, k=None, k_min=1, k_max=None):
+    """
+    Leading eigenvectors of the Bethe Hessian
+
+        Parameters:
+            adjacency (scipy.sparse matrix): (N x N) symmetric adjacency
+            k (int): number of eigenvectors, estimated as the number of negative
+                eigenvalues (clipped to [k_min, k_max]) if not given
+
+        Returns:
+            values (float[]): k smallest eigenvalues, ascending
+            vectors (float[][]): (N x k) corresponding eigenvectors
+    """
+    H, _r = bethe_hessian(adjacency)
+    N = H.shape[0]
+
+    num_eigs = k if k is not None else (k_max if k_max is not None else min(20, N - 2))
+    num_eigs = max(1, min(num_eigs, N - 2))
+    values, vectors = eigsh(H, k=num_eigs, which="SA")
+    order = np.argsort(values)
+    values, vectors = values[order], vectors[:, order]
+
+    if k is None:
+        k = int(np.sum(values < 0))
+        k = max(k, k_min)
+        if k_max is not None:
+            k = min(k, k_max)
+        k = min(k, num_eigs)
+
+    return values[:k], vectors[:, :k]
+
+
+def spectral_partition(adjacency, k=None, k_min=1, k_max=None, seed=None):
+    """
+    Community detection by k-means on the leading Bethe Hessian eigenvectors
+
+        Parameters:
+            adjacency (scipy.sparse matrix): (N x N) symmetric adjacency
+            k (int): number of communities, estimated as the number of negative
+                eigenvalues (clipped to [k_min, k_max]) if not given
+            seed (int): seed for k-means
+
+        Returns:
+            labels (int[]): community of each vertex in 0..k-1
+            vectors (float[][]): (N x k) leading eigenvectors (smallest eigenvalue first)
+    """
+    _values, vectors = spectral_embedding(adjacency, k, k_min, k_max)
+    N, k = vectors.shape
+    if k == 1:
+        return np.zeros(N, dtype=np.int64), vectors
+
+    kmeans = KMeans(n_clusters=k, n_init=10, random_state=seed).fit(vectors)
+    return kmeans.labels_.astype(np.int64), vectors
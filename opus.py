@@ -99,41 +99,22 @@ def create_maier_graph():
 
 
 def create_fb_graph():
-    
-    class Graph_Custom (Graph_MCMC):
-
-        def get_feature_names(self):
-            feature_name_map = self.G.graph_properties["feat_names"]
-            names = []
-
-            for i in range(0, len(feature_name_map)):
-                name = feature_name_map[i]
-                name = name.replace(";", "-")
-                name = name.replace("anonymized feature ", "")
-                names.append(name)
-            
-            return names
-
-
-        def generate_feature_matrix(self):
-            feat_map = self.G.vertex_properties["feat"]
-            feat_names = self.get_feature_names()
-
-            vertices = self.G.get_vertices()
-            
-            N = len(vertices)
-            D = len(feat_names)
-            X = np.empty((N, D))
-
-            for vertex_index, vertex_id in enumerate(vertices):
-                boolean_vector = feat_map[vertex_id]
-                for prop_index in range(0, D):
-                    X[vertex_index, prop_index] = boolean_vector[prop_index]
-            
-            return X
-
-    graph = Graph_Custom()
+    graph = Graph_MCMC()
     graph.read_from_ns("ego_social/facebook_1912")
+
+    feature_name_map = graph.G.graph_properties["feat_names"]
+    names = []
+
+    for i in range(0, len(feature_name_map)):
+        name = feature_name_map[i]
+        name = name.replace(";", "-")
+        name = name.replace("anonymized feature ", "")
+        names.append(name)
+
+    # pack vector-valued "feat" property into bit-packed flags
+    flags = graph.get_property_map("feat").get_2d_array(range(len(names)))
+    graph.add_flags(names, flags.T)
+    graph.remove_property("feat")
     return graph, fb_args
 
 def latex_print(means, std_devs, dp=3):
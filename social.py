@@ -3,7 +3,6 @@ from typing import List
 from hypothesis.test_statistics import two_samples_mean_ll_ratio, students_z_test
 from model.graph import Graph
 from model.graph_mcmc import Graph_MCMC
-import numpy as np
 
 
 def standard():
@@ -29,21 +28,16 @@ def standard():
 def mcmc():
     ego_id = 0 # 0 or 107
     fb = FacebookGraph(str(ego_id))
-    int_edges = [ (int(edge[0]), int(edge[1])) for edge in fb.edges]
-    int_edges = np.array(int_edges)
 
     graph = Graph_MCMC()
-    graph.read_from_edges(int_edges)
+    graph.read_from_edges(fb.edge_array)
     vertices = graph.get_vertex_list()
     
     selected_feat_ids, selected_feat_names = fb.get_feat_ids_and_names(keywords=["gender", "language", "hometown", "last_name"])
     #selected_feat_ids, selected_feat_names = fb.get_feat_ids_and_names()
 
-
-    for feat_id in selected_feat_ids:
-        feature_name = fb.feature_name(feat_id)
-        feature_flags = [fb.node_has_feature(str(vertex), feat_id) for vertex in vertices]
-        graph.add_property(feature_name, "bool", feature_flags)
+    feature_flags = fb.features.to_dense(fb.node_rows(vertices), selected_feat_ids, dtype=bool)
+    graph.add_flags([fb.feature_name(feat_id) for feat_id in selected_feat_ids], feature_flags)
 
     graph.partition(B_min=2, B_max=10)
     graph.mcmc(num_iter=100)
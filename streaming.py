@@ -13,7 +13,7 @@ def save():
 def analyse():
     print("Loading from file...")
     graph = Graph_MCMC()
-    graph.read_from_file("twitch.gt")
+    graph.read_from_saved("twitch")
     print("Done")
 
     graph.partition(B_min=4, B_max=4)
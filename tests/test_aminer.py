@@ -0,0 +1,32 @@
+import numpy as np
+import data.aminer as aminer
+from data.aminer import AMiner
+from data.names import GENDER_CODES
+
+
+def _synthetic_aminer(tmp_path, monkeypatch, lines):
+    (tmp_path / "AMiner-Coauthor.txt").write_text("".join(lines))
+    monkeypatch.setattr(aminer, "aminer_dir", str(tmp_path))
+
+    # author 0: M, 1: F, 2: U, 3: M (author 9 is missing)
+    graph = AMiner.__new__(AMiner)
+    graph.gender_codes = np.array([GENDER_CODES.index(g) for g in "MFUM"], dtype=np.uint8)
+    return graph
+
+
+def test_count_coauthor_pairs(tmp_path, monkeypatch):
+    lines = ["#0\t3\t2\n", "#0\t1\t1\n", "#1\t2\t5\n", "#9\t3\t1\n", "#3\t0\t4"] # no trailing newline
+    graph = _synthetic_aminer(tmp_path, monkeypatch, lines)
+    M, F, U = [GENDER_CODES.index(g) for g in "MFU"]
+
+    for block_size in [7, 2**26]:
+        counts = graph.count_coauthor_pairs(graph.gender_codes, len(GENDER_CODES), block_size=block_size)
+        assert counts.sum() == 5
+        assert counts[M, M] == 2
+        assert counts[min(M, F), max(M, F)] == 1
+        assert counts[min(F, U), max(F, U)] == 1
+        assert counts[min(U, M), max(U, M)] == 1 # missing author counted as U
+
+    weighted = graph.count_coauthor_pairs(graph.gender_codes, len(GENDER_CODES), weighted=True)
+    assert weighted[M, M] == 6
+    assert weighted.sum() == 13
@@ -0,0 +1,90 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+def batch_means_variance(trace, num_batches=10):
+    """Variance of the mean of an autocorrelated trace estimated from batch means"""
+    n = len(trace)
+    num_batches = min(num_batches, n)
+    batch_size = n // num_batches
+    batch_means = np.mean(np.reshape(trace[:batch_size * num_batches], (num_batches, batch_size)), axis=1)
+    return np.var(batch_means, ddof=1) / num_batches
+
+
+def geweke_z(trace, first=0.1, last=0.5):
+    """
+    Geweke diagnostic comparing means of start and end of a trace
+
+        Parameters:
+            trace (float[]): e.g. entropy per sweep
+            first (float): fraction of trace forming first segment
+            last (float): fraction of trace forming last segment
+
+        Returns:
+            z (float): approx N(0, 1) if trace is stationary
+    """
+    trace = np.asarray(trace, dtype=float)
+    n = len(trace)
+    a = trace[:max(int(first * n), 2)]
+    b = trace[n - max(int(last * n), 2):]
+
+    var = batch_means_variance(a) + batch_means_variance(b)
+    if var == 0:
+        return 0.0 if np.mean(a) == np.mean(b) else np.inf
+    return (np.mean(a) - np.mean(b)) / np.sqrt(var)
+
+
+def detect_burn_in(trace, step=0.05, threshold=2.0, min_length=50):
+    """
+    Earliest start (in steps of step * len(trace)) after which trace passes Geweke
+
+        Returns:
+            burn_in (int): index of first stationary element, None if not yet stationary
+    """
+    n = len(trace)
+    stride = max(int(step * n), 1)
+    for start in range(0, n // 2 + 1, stride):
+        if n - start >= min_length and abs(geweke_z(trace[start:])) < threshold:
+            return start
+    return None
+
+
+def label_counts(bs, B):
+    """(N x B) histogram of labels in (num_samples x N) array of partitions"""
+    bs = np.asarray(bs)
+    N = bs.shape[1]
+    flat = np.arange(N)[None, :] * B + bs
+    return np.bincount(flat.ravel(), minlength=N * B).reshape(N, B)
+
+
+def match_labels(labels_from, labels_to, B_from, B_to):
+    """
+    Relabelling of labels_from onto labels_to maximising their overlap
+
+        Returns:
+            mapping (int[]): new label of each of B_from labels, unmatched labels
+                get fresh labels from B_to upwards
+    """
+    overlap = np.bincount(labels_from * B_to + labels_to, minlength=B_from * B_to).reshape(B_from, B_to)
+    rows, cols = linear_sum_assignment(-overlap)
+
+    mapping = np.full(B_from, -1, dtype=np.int64)
+    mapping[rows] = cols
+    unmatched = mapping < 0
+    mapping[unmatched] = B_to + np.arange(np.count_nonzero(unmatched))
+    return mapping
+
+
+def marginal_entropy(counts):
+    """Per-vertex entropy (nats) of (N x B) marginal counts"""
+    totals = np.sum(counts, axis=1, keepdims=True)
+    probs = counts / np.maximum(totals, 1)
+    logs = np.log(np.where(probs > 0, probs, 1))
+    return - np.sum(probs * logs, axis=1)
+
+
+def total_variation(counts_a, counts_b):
+    """Mean over vertices of total variation distance between (N x B) marginals"""
+    p_a = counts_a / np.maximum(np.sum(counts_a, axis=1, keepdims=True), 1)
+    p_b = counts_b / np.maximum(np.sum(counts_b, axis=1, keepdims=True), 1)
+    return 0.5 * np.mean(np.sum(np.abs(p_a - p_b), axis=1))
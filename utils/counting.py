@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def lookup_codes(codes, ids, missing=0):
+    """
+    Categorical code of each id by array indexing
+
+        Parameters:
+            codes (int[]): dense code array indexed by id
+            ids (int[]): ids to look up
+            missing (int): code of ids outside codes
+
+        Returns:
+            id_codes (int[]): code of each id
+    """
+    ids = np.asarray(ids)
+    known = (ids >= 0) & (ids < len(codes))
+    id_codes = np.full(len(ids), missing, dtype=np.int64)
+    id_codes[known] = codes[ids[known]]
+    return id_codes
+
+
+def pair_counts(codes_a, codes_b, num_categories, weights=None, symmetric=True):
+    """
+    (C x C) (weighted) counts of category pairs via bincount on a combined code
+
+        Parameters:
+            codes_a (int[]): category of first element of each pair
+            codes_b (int[]): category of second element of each pair
+            num_categories (int): C
+            weights (float[]): optional weight of each pair
+            symmetric (bool): fold (a, b) and (b, a) into upper triangle
+
+        Returns:
+            counts (int[][] | float[][]): counts[a, b] of pairs with categories a, b
+    """
+    C = num_categories
+    combined = np.asarray(codes_a, dtype=np.int64) * C + np.asarray(codes_b, dtype=np.int64)
+    counts = np.bincount(combined, weights=weights, minlength=C * C).reshape(C, C)
+    if weights is None:
+        counts = counts.astype(np.int64)
+
+    if symmetric:
+        counts = np.triu(counts + counts.T - np.diag(np.diag(counts)))
+    return counts
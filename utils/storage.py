@@ -0,0 +1,49 @@
+import numpy as np
+import os
+import tempfile
+
+
+def atomic_savez(filepath, **arrays):
+    """Writes arrays to .npz, replacing filepath only once fully written"""
+    directory = os.path.dirname(filepath)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+
+    # unique temp file so concurrent writers never share (or replace) a partial file
+    fd, tmp_filepath = tempfile.mkstemp(dir=directory or ".", prefix=os.path.basename(filepath) + ".", suffix=".tmp.npz")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            np.savez(fp, **arrays)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+
+
+def load_npz(filepath):
+    """Returns dict of arrays stored in .npz or None if no such file"""
+    if not os.path.exists(filepath):
+        return None
+    with np.load(filepath, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def rng_state_arrays():
+    """Global numpy RNG state as a dict of arrays (for atomic_savez)"""
+    _name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        "rng_keys": keys,
+        "rng_pos": np.array(pos),
+        "rng_has_gauss": np.array(has_gauss),
+        "rng_cached_gaussian": np.array(cached_gaussian)
+    }
+
+
+def restore_rng_state(arrays):
+    """Inverse of rng_state_arrays"""
+    state = (
+        "MT19937", arrays["rng_keys"], int(arrays["rng_pos"]),
+        int(arrays["rng_has_gauss"]), float(arrays["rng_cached_gaussian"])
+    )
+    np.random.set_state(state)
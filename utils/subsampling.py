@@ -1,20 +1,112 @@
 import numpy as np
 
 
-def random_index_arr(n, fraction):
+def _get_rng(seed):
+    return np.random if seed is None else np.random.RandomState(seed)
+
+
+def random_index_arr(n, fraction, seed=None):
     """
     Return two index arrays to form test and training set
 
         Parameters:
             n (int): length of array to index
             fraction (float): fraction to use for training set
+            seed (int): optional seed for reproducible splits
 
         Returns:
             train_indices (int[]): indices of training set
             test_indices (int[]): indices of test set    
     """
-    indices = np.random.permutation(n)
+    indices = _get_rng(seed).permutation(n)
     m = int(n * fraction)
     train_indices = indices[:m]
     test_indices = indices[m:]
-    return train_indices, test_indices
\ No newline at end of file
+    return train_indices, test_indices
+
+
+def stratified_index_arr(labels, fraction, seed=None):
+    """
+    Return train and test index arrays splitting each label class by fraction
+
+        Parameters:
+            labels (int[]): class label of each element
+            fraction (float): fraction of each class to use for training set
+            seed (int): optional seed for reproducible splits
+
+        Returns:
+            train_indices (int[]): indices of training set
+            test_indices (int[]): indices of test set
+
+    Any class with at least 2 members is represented in both sets
+    """
+    rng = _get_rng(seed)
+    grouped, classes, ranks = _group_by_label(labels, rng)
+
+    class_sizes = np.bincount(classes)
+    class_train_sizes = (class_sizes * fraction).astype(int)
+    shared = class_sizes >= 2
+    class_train_sizes[shared] = np.clip(class_train_sizes[shared], 1, class_sizes[shared] - 1)
+
+    train_mask = ranks < class_train_sizes[classes]
+    train_indices = rng.permutation(grouped[train_mask])
+    test_indices = rng.permutation(grouped[~train_mask])
+    return train_indices, test_indices
+
+
+def k_fold_index_arrs(n, k, labels=None, seed=None):
+    """
+    Return k (train, test) index array pairs with disjoint test folds
+
+        Parameters:
+            n (int): length of array to index
+            k (int): number of folds
+            labels (int[]): if given, folds are stratified by label
+            seed (int): optional seed for reproducible splits
+
+        Returns:
+            folds ((int[], int[])[]): list of (train_indices, test_indices)
+    """
+    rng = _get_rng(seed)
+    if labels is None:
+        grouped = rng.permutation(n)
+        fold_of = np.arange(n) % k
+    else:
+        assert len(labels) == n
+        grouped, _classes, ranks = _group_by_label(labels, rng)
+        fold_of = ranks % k
+
+    folds = []
+    for fold in range(0, k):
+        in_fold = fold_of == fold
+        folds.append((grouped[~in_fold], grouped[in_fold]))
+    return folds
+
+
+def indices_to_mask(indices, n):
+    """Boolean mask of length n set at indices"""
+    mask = np.zeros(n, dtype=bool)
+    mask[indices] = True
+    return mask
+
+
+def _group_by_label(labels, rng):
+    """
+    Random permutation of indices grouped by label
+
+        Returns:
+            grouped (int[]): indices, shuffled within each class
+            classes (int[]): dense class index of each entry of grouped
+            ranks (int[]): position of each entry of grouped within its class
+    """
+    labels = np.asarray(labels)
+    n = len(labels)
+    _values, label_classes = np.unique(labels, return_inverse=True)
+
+    shuffled = rng.permutation(n)
+    grouped = shuffled[np.argsort(label_classes[shuffled], kind="stable")]
+    classes = label_classes[grouped]
+
+    class_starts = np.concatenate(([0], np.cumsum(np.bincount(classes))[:-1]))
+    ranks = np.arange(n) - class_starts[classes]
+    return grouped, classes, ranks